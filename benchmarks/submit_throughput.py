@@ -0,0 +1,50 @@
+'''Throughput of extracting required files from submitted tasks, with and
+without the files being sent alongside the payload.
+
+Run from the repository root:
+    python -m benchmarks.submit_throughput
+'''
+
+import time
+import argparse
+
+from funcx.serialize import FuncXSerializer
+from central_scheduler import CentralScheduler
+
+
+SIZES = [2 ** 10, 2 ** 14, 2 ** 18, 2 ** 22, 2 ** 24]
+
+
+def make_payload(serializer, size, files):
+    ser_args = serializer.serialize(())
+    ser_kwargs = serializer.serialize({'data': 'x' * size,
+                                       '_globus_files': files})
+    return serializer.pack_buffers([ser_args, ser_kwargs])
+
+
+def throughput(scheduler, payload, files, duration):
+    n = 0
+    start = time.time()
+    while time.time() - start < duration:
+        scheduler._task_files(payload, files)
+        n += 1
+    return n / (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--duration', type=float, default=1.0)
+    args = parser.parse_args()
+
+    # Only the serializer is needed, so skip connecting to funcX and Globus
+    scheduler = CentralScheduler.__new__(CentralScheduler)
+    scheduler.fx_serializer = FuncXSerializer()
+    scheduler.fx_serializer.use_custom('03\n', 'code')
+
+    files = {}
+    print('{:>10} {:>16} {:>16}'.format('size', 'deserialize/s', 'sidecar/s'))
+    for size in SIZES:
+        payload = make_payload(scheduler.fx_serializer, size, files)
+        slow = throughput(scheduler, payload, None, args.duration)
+        fast = throughput(scheduler, payload, files, args.duration)
+        print(f'{size:>10} {slow:>16.1f} {fast:>16.1f}')
@@ -0,0 +1,301 @@
+'''Benchmarks of the scheduler's hot paths, for numbers of endpoints,
+functions and pending tasks.
+
+The scheduler runs without its background threads, against a local stand-in
+for funcX and the fake Globus client, so no services are needed. Results
+are written as JSON, so that they can be compared across commits.
+
+Run from the repository root:
+    python -m benchmarks.suite -o base.json
+    python -m benchmarks.suite --compare base.json
+    python -m benchmarks.suite --compare base.json new.json --threshold 0.2
+'''
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import tempfile
+import subprocess
+from itertools import product
+
+import utils
+from tasks import TaskRecord
+from strategies import init_strategy
+from predictors import init_runtime_predictor, ImportPredictor
+from fake_funcx import FakeTransferClient
+from central_scheduler import CentralScheduler
+
+
+STRATEGIES = ['round-robin', 'fastest-endpoint', 'smallest-eta']
+RUNTIME_PREDICTORS = ['rolling-average', 'input-length', 'ensemble']
+
+GRID = {
+    'endpoints': [4, 16, 64],
+    'functions': [1, 16],
+    'pending': [0, 1000],
+}
+QUICK_GRID = {'endpoints': [4], 'functions': [4], 'pending': [100]}
+
+
+class LocalFuncXClient(object):
+    '''Endpoint statuses of endpoints which are always alive and warm.'''
+
+    def get_endpoint_status(self, endpoint):
+        return [{'timestamp': time.time(), 'active_managers': 1}]
+
+
+def make_endpoints(n):
+    endpoints = {
+        f'bench-endpoint-{i}': {
+            'name': f'bench_{i}',
+            'group': f'group_{i % 4}',
+            'transfer_group': f'transfer_group_{i % 2}',
+            'globus': f'bench-globus-{i}',
+        }
+        for i in range(n)
+    }
+    # Log messages look up endpoint names in the global config
+    utils.ENDPOINTS.update(endpoints)
+    return endpoints
+
+
+class Environment(object):
+    '''A scheduler with some pending tasks, and predictors which have
+    learned the runtimes of each function on each endpoint.'''
+
+    def __init__(self, endpoints, functions, pending, strategy='smallest-eta'):
+        self.endpoints = make_endpoints(endpoints)
+        self.functions = [f'func_{i}' for i in range(functions)]
+        self._log = tempfile.NamedTemporaryFile(suffix='.jsonl')
+
+        self.scheduler = CentralScheduler(
+            endpoints=self.endpoints, strategy=strategy, log_level='ERROR',
+            execution_log_file=self._log.name, max_backups=1,
+            funcx_client=LocalFuncXClient(),
+            transfer_client=FakeTransferClient(), start_threads=False)
+        self.result = self.scheduler.fx_serializer.serialize(
+            {'result': None, 'runtime': 1.0, 'imports': []})
+
+        for func, endpoint in product(self.functions, self.endpoints):
+            for _ in range(5):
+                self.scheduler.runtime.update(self.record(func, endpoint),
+                                              1.0)
+
+        self.pending = self.submit(pending)
+
+    def record(self, func, endpoint):
+        info = TaskRecord(function_id=func, payload_size=64, headers={},
+                          files={}, time_requested=time.time())
+        info.endpoint_id = endpoint
+        return info
+
+    def submit(self, n):
+        '''Submit n tasks, and mark them as sent to funcX, as the task
+        watchdog would, returning their funcX task ids.'''
+        tasks = [(self.functions[i % len(self.functions)], 'x' * 64, {})
+                 for i in range(n)]
+        self.scheduler.batch_submit(tasks, headers={})
+
+        scheduler = self.scheduler
+        real_task_ids = []
+        now = time.time()
+        while not scheduler._scheduled_tasks.empty():
+            task_id, endpoint, num, _ = \
+                scheduler._scheduled_tasks.get_nowait()
+            info = scheduler._task_info[task_id].copy()
+            info.task_id = task_id
+            info.endpoint_id = endpoint
+            info.transfer_num = num
+            info.ETA = now + 1.0
+            info.is_ETA_reliable = True
+            info.time_sent = now
+
+            real_task_id = str(uuid.uuid4())
+            scheduler._task_id_translation[task_id].add(real_task_id)
+            scheduler._pending[real_task_id] = info
+            scheduler._pending_by_endpoint[endpoint].add(real_task_id)
+            scheduler._payloads.release(task_id)
+            real_task_ids.append(real_task_id)
+
+        return real_task_ids
+
+
+def per_op(func, n, repeat=3):
+    '''Seconds per call of func(i), for i in range(n), in the fastest of a
+    few repetitions to reduce noise.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(n):
+            func(i)
+        times.append((time.perf_counter() - start) / n)
+    return min(times)
+
+
+def bench_strategies(env, n):
+    s = env.scheduler
+    for name in STRATEGIES:
+        strategy = init_strategy(name, endpoints=env.endpoints,
+                                 runtime_predictor=s.runtime,
+                                 queue_predictor=s.queue_delay,
+                                 cold_start_predictor=s.cold_start,
+                                 transfer_predictor=s.transfer_time)
+        funcs = env.functions
+        yield f'choose_endpoint.{name}', per_op(
+            lambda i: strategy.choose_endpoint(
+                funcs[i % len(funcs)], payload='x' * 64, files={},
+                transfer_ETAs=s._transfer_ETAs), n)
+
+    endpoints = list(env.endpoints)
+    yield 'predict_ETA', per_op(
+        lambda i: s.strategy.predict_ETA(
+            env.functions[i % len(env.functions)],
+            endpoints[i % len(endpoints)], 'x' * 64), n)
+
+
+def bench_predictors(env, n):
+    endpoints = list(env.endpoints)
+    groups = sorted({x['group'] for x in env.endpoints.values()})
+    funcs = env.functions
+
+    for name in RUNTIME_PREDICTORS:
+        predictor = init_runtime_predictor(name, endpoints=env.endpoints)
+        records = [env.record(funcs[i % len(funcs)],
+                              endpoints[i % len(endpoints)])
+                   for i in range(n)]
+        yield f'{name}.update', per_op(
+            lambda i: predictor.update(records[i], 1.0), n, repeat=1)
+        yield f'{name}.predict', per_op(
+            lambda i: predictor.predict(funcs[i % len(funcs)],
+                                        groups[i % len(groups)], 'x' * 64), n)
+
+    transfer = env.scheduler.transfer_time
+    files = {endpoints[0]: [('bench.dat', 2 ** 20)]}
+    yield 'transfer.update', per_op(
+        lambda i: transfer.update(endpoints[0], endpoints[-1],
+                                  2 ** 20 + i, 1.0), min(n, 200), repeat=1)
+    yield 'transfer.predict', per_op(
+        lambda i: transfer.predict(files, endpoints[i % len(endpoints)]), n)
+
+    imports = ImportPredictor(endpoints=env.endpoints)
+    yield 'import.update', per_op(
+        lambda i: imports.record(f'pkg_{i % 16}',
+                                 endpoints[i % len(endpoints)], 1.0), n)
+    yield 'import.predict', per_op(
+        lambda i: imports.predict(f'pkg_{i % 16}',
+                                  endpoints[i % len(endpoints)]), n)
+
+
+def bench_scheduler(env, n):
+    s = env.scheduler
+    funcs = env.functions
+
+    yield 'batch_submit', per_op(
+        lambda i: s.batch_submit([(funcs[i % len(funcs)], 'x' * 64, {})],
+                                 headers={}), n)
+    env.submit(0)  # Mark the submitted tasks as sent
+
+    real_task_ids = env.submit(n)
+    data = {'status': 'SUCCESS', 'result': env.result}
+    yield 'log_status', per_op(
+        lambda i: s.log_status(real_task_ids[i], data), n, repeat=1)
+
+    real_task_ids = env.submit(n)
+    start = time.perf_counter()
+    s._send_backups_if_needed(real_task_ids)
+    yield '_send_backups_if_needed', (time.perf_counter() - start) / n
+    env.submit(0)
+
+
+BENCHMARKS = [bench_strategies, bench_predictors, bench_scheduler]
+
+
+def run(grid, n):
+    results = {}
+    for endpoints, functions, pending in product(
+            grid['endpoints'], grid['functions'], grid['pending']):
+        params = {'endpoints': endpoints, 'functions': functions,
+                  'pending': pending}
+        suffix = ','.join(f'{k}={v}' for (k, v) in params.items())
+        for bench in BENCHMARKS:
+            # Each benchmark starts from the same state
+            env = Environment(endpoints, functions, pending)
+            for name, seconds in bench(env, n):
+                key = f'{name}[{suffix}]'
+                results[key] = {'params': params,
+                                'us_per_op': 1e6 * seconds}
+                print(f'{key:70} {1e6 * seconds:12.2f} us', file=sys.stderr)
+
+    return {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'ops': n,
+        'results': results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base, new, threshold):
+    '''Print the change of each benchmark, and return the regressions:
+    benchmarks which got slower by more than the threshold.'''
+    regressions = []
+    print('{:70} {:>12} {:>12} {:>8}'.format('benchmark', 'base (us)',
+                                             'new (us)', 'change'))
+    for key, result in sorted(new['results'].items()):
+        if key not in base['results']:
+            continue
+        before = base['results'][key]['us_per_op']
+        after = result['us_per_op']
+        change = after / before - 1.0 if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f'{key:70} {before:12.2f} {after:12.2f} {change:+8.1%}{flag}')
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-ops', type=int, default=500)
+    parser.add_argument('--quick', action='store_true', default=False)
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='File to write results to, instead of stdout')
+    parser.add_argument('--compare', type=str, nargs='+', default=None,
+                        help='Baseline results, and optionally new results '
+                        '(by default, the benchmarks are run)')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None and len(args.compare) > 1:
+        with open(args.compare[1]) as fh:
+            results = json.load(fh)
+    else:
+        results = run(QUICK_GRID if args.quick else GRID, args.num_ops)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    elif args.compare is None:
+        print(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        with open(args.compare[0]) as fh:
+            base = json.load(fh)
+        regressions = compare(base, results, args.threshold)
+        if len(regressions) > 0:
+            print(f'{len(regressions)} regressions')
+            sys.exit(1)
@@ -0,0 +1,69 @@
+'''Memory used per pending task by its record, as a dict (the previous
+representation) and as a TaskRecord.
+
+Run from the repository root:
+    python -m benchmarks.task_memory
+'''
+
+import time
+import uuid
+import argparse
+import tracemalloc
+
+from tasks import TaskRecord
+
+
+def make_dict(headers, files):
+    info = {
+        'function_id': str(uuid.uuid4()),
+        'payload_size': 1024,
+        'headers': headers,
+        'files': files,
+        'cache_key': None,
+        'time_requested': time.time()
+    }
+    info['task_id'] = str(uuid.uuid4())
+    info['endpoint_id'] = str(uuid.uuid4())
+    info['transfer_num'] = None
+    info['transfer_time'] = 0.0
+    info['ETA'] = time.time()
+    info['is_ETA_reliable'] = True
+    info['time_sent'] = time.time()
+    return info
+
+
+def make_record(headers, files):
+    info = TaskRecord(function_id=str(uuid.uuid4()),
+                      payload_size=1024,
+                      headers=headers,
+                      files=files,
+                      time_requested=time.time())
+    info.task_id = str(uuid.uuid4())
+    info.endpoint_id = str(uuid.uuid4())
+    info.transfer_time = 0.0
+    info.ETA = time.time()
+    info.is_ETA_reliable = True
+    info.time_sent = time.time()
+    return info
+
+
+def bytes_per_task(make, n):
+    # Headers and files are shared between tasks of the same submission
+    headers, files = {}, {}
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    records = [make(headers, files) for _ in range(n)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(records) == n
+    return (after - before) / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-tasks', type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, make in [('dict', make_dict), ('TaskRecord', make_record)]:
+        print('{:>10}: {:.1f} bytes per pending task'
+              .format(name, bytes_per_task(make, args.num_tasks)))
@@ -0,0 +1,92 @@
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+
+from utils import colored
+
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter(
+    colored("[CACHE]     %(message)s", 'green')))
+logger.addHandler(ch)
+
+
+def task_key(func, payload):
+    '''Hash identifying a (function, payload) pair.'''
+    h = hashlib.sha256()
+    h.update(func.encode())
+    h.update(b'\0')
+    h.update(payload.encode())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    '''LRU cache of task results, with a time-to-live for each entry and a
+    cap on the total size of the cached (serialized) results.
+
+    Also tracks which keys are currently being computed, so that identical
+    submissions can wait on the same task instead of running it again.'''
+
+    def __init__(self, max_entries=1024, ttl=3600.0, max_bytes=2 ** 28,
+                 log_level='INFO'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        logger.setLevel(log_level)
+
+        self._results = OrderedDict()  # key -> (time_cached, size, value)
+        self._in_flight = {}  # key -> (virtual) task id computing it
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self._results:
+            self.misses += 1
+            return None
+
+        time_cached, _, value = self._results[key]
+        if time.time() - time_cached > self.ttl:
+            self._evict(key)
+            self.misses += 1
+            return None
+
+        self._results.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            logger.debug(f'Not caching result of size {size} for {key}')
+            return
+
+        if key in self._results:
+            self._evict(key)
+
+        self._results[key] = (time.time(), size, value)
+        self.num_bytes += size
+
+        # Evict least-recently used results until we are within limits
+        while len(self._results) > self.max_entries \
+                or self.num_bytes > self.max_bytes:
+            oldest = next(iter(self._results))
+            logger.debug(f'Evicting cached result {oldest}')
+            self._evict(oldest)
+
+    def in_flight(self, key):
+        return self._in_flight.get(key)
+
+    def start(self, key, task_id):
+        self._in_flight[key] = task_id
+
+    def finish(self, key):
+        self._in_flight.pop(key, None)
+
+    def _evict(self, key):
+        _, size, _ = self._results.pop(key)
+        self.num_bytes -= size
+
+    def __len__(self):
+        return len(self._results)
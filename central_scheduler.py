@@ -1,20 +1,33 @@
+import os
 import sys
 import time
 import json
 import uuid
 import logging
+import heapq
 import requests
 from queue import Queue, Empty
-from threading import Thread
+from threading import Thread, Condition, Event
+from functools import partial
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    TimeoutError, as_completed
 
 from funcx import FuncXClient
 from funcx.serialize import FuncXSerializer
 from utils import colored, endpoint_name
 from transfer import TransferManager
+from cache import ResultCache, task_key
+from payloads import PayloadStore
+from retention import Retention
+from execution_log import ExecutionLog
+from tasks import TaskRecord
+from health import EndpointHealth
+from prefetch import Prefetcher
+from metrics import MetricsRegistry, SamplingProfiler
 from strategies import init_strategy
 from predictors import init_runtime_predictor, TransferPredictor, \
-    ImportPredictor
+    ImportPredictor, ColdStartPredictor, Ensemble
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +41,32 @@ FUNCX_API = 'https://funcx.org/api/v1'
 HEARTBEAT_THRESHOLD = 75.0  # Endpoints send regular heartbeats
 CLIENT_ID = 'f06739da-ad7d-40bd-887f-abb1d23bbd6f'
 BLOCK_ERRORS = [ModuleNotFoundError, MemoryError]
+GC_INTERVAL = 30.0  # Seconds between evictions of expired task state
+MODEL_SAVE_INTERVAL = 300.0  # Seconds between saves of learned models
+# Endpoint statuses are polled concurrently, more often for endpoints whose
+# state is changing or suspicious, and less often for stable ones
+POLL_WORKERS = 8
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+# Longest time to wait for status polls before handling other endpoints
+POLL_TIMEOUT = HEARTBEAT_THRESHOLD / 5
+
+
+# Serializer used by result-deserialization worker processes
+_worker_serializer = None
+
+
+def _init_result_worker():
+    global _worker_serializer
+    _worker_serializer = FuncXSerializer()
+    _worker_serializer.use_custom('03\n', 'code')
+
+
+def _result_metadata(serialized_result):
+    '''Deserialize a task result in a worker process, and send back only
+    the metadata needed for scheduling, not the user's return value.'''
+    result = _worker_serializer.deserialize(serialized_result)
+    return result['runtime'], result['imports']
 
 
 class CentralScheduler(object):
@@ -35,27 +74,78 @@ class CentralScheduler(object):
     def __init__(self, endpoints, strategy='round-robin',
                  runtime_predictor='rolling-average', last_n=3, train_every=1,
                  log_level='INFO', import_model_file=None,
-                 transfer_model_file=None, sync_level='exists',
+                 transfer_model_file=None, model_dir=None,
+                 sync_level='exists',
                  max_backups=0, backup_delay_threshold=2.0,
+                 cache_size=1024, cache_ttl=3600.0, cache_max_bytes=2 ** 28,
+                 deserialize_workers=0, retention_ttl=3600.0,
+                 execution_log_file='execution_log.jsonl',
+                 ignore_late_results=False, transfer_window=0.5,
+                 storage_quota=None, delete_evicted=False, staging_dir=None,
+                 prefetch=False, prefetch_budget=1e7,
+                 late_binding=False, rebind_margin=1.0, funcx_api=FUNCX_API,
+                 funcx_client=None, transfer_client=None, start_threads=True,
                  *args, **kwargs):
-        self._fxc = FuncXClient(*args, **kwargs)
+        # Clients can be replaced, e.g., by fakes for load testing
+        self.funcx_api = funcx_api
+        self._fxc = funcx_client or FuncXClient(*args, **kwargs)
 
         # Initialize a transfer client
-        self._transfer_manger = TransferManager(endpoints=endpoints,
-                                                sync_level=sync_level,
-                                                log_level=log_level)
+        self._transfer_manger = TransferManager(
+            endpoints=endpoints, sync_level=sync_level,
+            retention_ttl=retention_ttl, coalesce_window=transfer_window,
+            storage_quota=storage_quota, delete_evicted=delete_evicted,
+            staging_dir=staging_dir, transfer_client=transfer_client,
+            log_level=log_level)
 
         # Info about FuncX endpoints we can execute on
         self._endpoints = endpoints
         self._dead_endpoints = set()
         self.last_result_time = defaultdict(float)
         self.temperature = defaultdict(lambda: 'WARM')
+        self._warming_since = {}
         self._imports = defaultdict(list)
         self._imports_required = defaultdict(list)
 
         # Track which endpoints a function can't run on
         self._blocked = defaultdict(set)
 
+        # Metrics exposed on /metrics, and an optional profiler
+        self.metrics = MetricsRegistry()
+        self._decision_time = self.metrics.histogram(
+            'scheduling_decision_seconds',
+            'Time taken to choose an endpoint for a task')
+        self._submit_time = self.metrics.histogram(
+            'funcx_submit_seconds',
+            'Round-trip time of submitting a batch of tasks to funcX')
+        self._queued_time = self.metrics.histogram(
+            'task_queued_seconds',
+            'Time between scheduling a task and sending it to funcX')
+        self._transfer_wait = self.metrics.histogram(
+            'transfer_wait_seconds',
+            'Time tasks waited for their files to be transferred')
+        self._prediction_error = self.metrics.histogram(
+            'prediction_error_seconds',
+            'Absolute difference between predicted and actual task ETAs',
+            labels=('function', 'group'))
+        self._backups_sent = self.metrics.counter(
+            'backups_sent_total', 'Backup copies of tasks sent')
+        self.metrics.gauge(
+            'pending_tasks', 'Tasks sent to each endpoint and not finished',
+            labels=('endpoint',), function=lambda: {
+                (self._endpoints[e]['name'],): len(ids)
+                for (e, ids) in list(self._pending_by_endpoint.items())})
+        self.metrics.gauge(
+            'waiting_tasks', 'Tasks scheduled but not yet sent to funcX',
+            function=lambda: {(): self._num_waiting})
+        self._num_waiting = 0
+        self.profiler = SamplingProfiler()
+
+        # Track which endpoints are degraded, even if they are still alive
+        self._health = EndpointHealth(endpoints,
+                                      heartbeat_threshold=HEARTBEAT_THRESHOLD,
+                                      log_level=log_level)
+
         # Track pending tasks
         # We will provide the client our own task ids, since we may submit the
         # same task multiple times to the FuncX service, and sometimes we may
@@ -64,10 +154,29 @@ class CentralScheduler(object):
         self._pending = {}
         self._pending_by_endpoint = defaultdict(set)
         self._task_info = {}
+        # Single copy of each task's payload, keyed by (virtual) task id.
+        # The task itself holds a reference until it completes, and each
+        # scheduled copy of it holds one until it is sent to FuncX.
+        self._payloads = PayloadStore()
         # List of endpoints a (virtual) task was scheduled to
         self._endpoints_sent_to = defaultdict(list)
         self.max_backups = max_backups
         self.backup_delay_threshold = backup_delay_threshold
+        # Min-heap of (deadline, real task id) at which a backup of a
+        # pending task should be sent. Timers of completed tasks are
+        # skipped when they fire, instead of being removed from the heap.
+        self._backup_deadlines = []
+        self._backup_cv = Condition()
+        # Once one copy of a task completes, its other pending copies are
+        # abandoned. Their results may still be used to learn runtimes.
+        self._abandoned = {}
+        self.ignore_late_results = ignore_late_results
+        # Re-validate the endpoint of tasks which could run elsewhere
+        # without new transfers when they are sent, and move them if
+        # another endpoint is predicted to finish them sooner by a margin
+        self.late_binding = late_binding
+        self.rebind_margin = rebind_margin
+        self.hedging_stats = defaultdict(float)
         self._latest_status = {}
         self._last_task_ETA = defaultdict(float)
         # Maximum ETA, if any, of a task which we allow to be scheduled on an
@@ -78,29 +187,94 @@ class CentralScheduler(object):
         # Updated every time a task result is received from an endpoint.
         self._queue_error = defaultdict(float)
 
+        # Cache of results for functions which opted in to memoization.
+        # Identical submissions of an in-flight task become aliases of it.
+        self._cached_functions = set()
+        self._result_cache = ResultCache(max_entries=cache_size,
+                                         ttl=cache_ttl,
+                                         max_bytes=cache_max_bytes,
+                                         log_level=log_level)
+        self._aliases = {}
+
+        # State of finished tasks is kept for some time, so that clients can
+        # still query it, and then forgotten
+        self._retention = Retention(retention_ttl)
+
         # Set logging levels
         logger.setLevel(log_level)
-        self.execution_log = []
+        self.execution_log = ExecutionLog(execution_log_file)
 
         # Intialize serializer
         self.fx_serializer = FuncXSerializer()
         self.fx_serializer.use_custom('03\n', 'code')
 
+        # Optionally deserialize results in worker processes, so that the
+        # request path never blocks on (or holds) large return values
+        if deserialize_workers > 0:
+            self._result_pool = ProcessPoolExecutor(
+                max_workers=deserialize_workers,
+                initializer=_init_result_worker)
+        else:
+            self._result_pool = None
+        self._awaiting_metadata = set()
+        # Results read by worker processes are handled on the task-watchdog
+        # thread, not on the thread running the executor's callbacks
+        self._finished_metadata = Queue()
+
         # Initialize runtime predictor
         self.runtime = init_runtime_predictor(runtime_predictor,
                                               endpoints=endpoints,
                                               last_n=last_n,
                                               train_every=train_every)
         logger.info(f"Runtime predictor using strategy {self.runtime}")
+        if isinstance(self.runtime, Ensemble):
+            self.metrics.gauge(
+                'runtime_model_error_seconds',
+                'Moving average of the absolute error of each runtime model',
+                labels=('function', 'group', 'model'), function=lambda: {
+                    (func, group, model): error
+                    for (func, by_group) in self.runtime.summary().items()
+                    for (group, errors) in by_group.items()
+                    for (model, error) in errors.items()
+                    if error is not None})
+
+        # Learned models are saved regularly to model_dir, to survive
+        # restarts. They are loaded instead of the hand-made model files,
+        # which are never overwritten.
+        self._model_dir = model_dir
+        learned = {name: self._learned_model_file(name) for name in
+                   ['transfer_model.json', 'import_model.json',
+                    'cold_start_model.json']}
+
+        def state_file(name, default):
+            if learned[name] is not None and os.path.exists(learned[name]):
+                return learned[name]
+            return default
 
         # Initialize transfer-time predictor
-        self.transfer_time = TransferPredictor(endpoints=endpoints,
-                                               train_every=train_every,
-                                               state_file=transfer_model_file)
+        self.transfer_time = TransferPredictor(
+            endpoints=endpoints, train_every=train_every,
+            state_file=state_file('transfer_model.json',
+                                  transfer_model_file),
+            transfer_manager=self._transfer_manger)
+        self._transfer_manger.add_callback(
+            self.transfer_time.on_transfer_complete)
 
         # Initialize import-time predictor
-        self.import_predictor = ImportPredictor(endpoints=endpoints,
-                                                state_file=import_model_file)
+        self.import_predictor = ImportPredictor(
+            endpoints=endpoints,
+            state_file=state_file('import_model.json', import_model_file))
+
+        # Initialize launch-time predictor, learned from cold starts
+        self.launch_predictor = ColdStartPredictor(
+            endpoints=endpoints,
+            state_file=learned['cold_start_model.json'])
+
+        self._model_files = [
+            (self.transfer_time, learned['transfer_model.json']),
+            (self.import_predictor, learned['import_model.json']),
+            (self.launch_predictor, learned['cold_start_model.json']),
+        ]
 
         # Initialize scheduling strategy
         self.strategy = init_strategy(strategy, endpoints=endpoints,
@@ -110,15 +284,40 @@ class CentralScheduler(object):
                                       transfer_predictor=self.transfer_time)
         logger.info(f"Scheduler using strategy {self.strategy}")
 
+        # Optionally stage files of upcoming tasks ahead of time
+        self._prefetcher = None
+        if prefetch:
+            self._prefetcher = Prefetcher(self._transfer_manger,
+                                          self.strategy,
+                                          budget=prefetch_budget,
+                                          log_level=log_level)
+
         # Start thread to check on endpoints regularly
         self._endpoint_watchdog = Thread(target=self._check_endpoints)
-        self._endpoint_watchdog.start()
 
         # Start thread to monitor tasks and send tasks to FuncX service
         self._scheduled_tasks = Queue()
         self._task_watchdog_sleep = 0.15
+        # Wake up task watchdog as soon as a transfer completes
+        self._task_wakeup = Event()
+        self._transfer_manger.add_callback(
+            lambda *args: self._task_wakeup.set())
         self._task_watchdog = Thread(target=self._monitor_tasks)
-        self._task_watchdog.start()
+
+        # Start thread to send backup tasks when pending tasks are overdue
+        self._backup_watchdog = Thread(target=self._watch_deadlines)
+        self._backup_watchdog.daemon = True
+
+        # Start thread to forget about old tasks
+        self._garbage_collector = Thread(target=self._collect_garbage)
+        self._garbage_collector.daemon = True
+
+        # Benchmarks drive the scheduler without its background threads
+        if start_threads:
+            self._endpoint_watchdog.start()
+            self._task_watchdog.start()
+            self._backup_watchdog.start()
+            self._garbage_collector.start()
 
     def block(self, func, endpoint):
         if endpoint not in self._endpoints:
@@ -141,6 +340,24 @@ class CentralScheduler(object):
             self._blocked[func].add(endpoint)
             return {'status': 'Success'}
 
+    def enable_caching(self, func):
+        logger.info('Caching results of function {}'.format(func))
+        self._cached_functions.add(func)
+        return {'status': 'Success'}
+
+    def endpoint_health(self):
+        health = self._health.summary()
+        # Launch times observed when the endpoints were cold
+        for endpoint, launches in self.launch_predictor.summary().items():
+            if endpoint in health:
+                health[endpoint]['launch_time'] = launches
+        return health
+
+    def prefetch_stats(self):
+        if self._prefetcher is None:
+            return {}
+        return self._prefetcher.summary()
+
     def register_imports(self, func, imports):
         logger.info('Registered function {} with imports {}'
                     .format(func, imports))
@@ -152,22 +369,67 @@ class CentralScheduler(object):
         task_ids = []
         endpoints = []
 
-        for func, payload in tasks:
-            _, ser_kwargs = self.fx_serializer.unpack_buffers(payload)
-            kwargs = self.fx_serializer.deserialize(ser_kwargs)
-            files = kwargs['_globus_files']
+        for func, payload, files in tasks:
+            cache_key = None
+            if func in self._cached_functions:
+                cache_key = task_key(func, payload)
+                cached = self._from_cache(cache_key)
+                if cached is not None:
+                    task_ids.append(cached[0])
+                    endpoints.append(cached[1])
+                    continue
 
+            files = self._task_files(payload, files)
             task_id, endpoint = self._schedule_task(func=func,
                                                     payload=payload,
                                                     headers=headers,
-                                                    files=files)
+                                                    files=files,
+                                                    cache_key=cache_key)
             task_ids.append(task_id)
             endpoints.append(endpoint)
 
         return task_ids, endpoints
 
+    def _task_files(self, payload, files=None):
+        '''Files required by a task. Clients can send these alongside the
+        payload, which avoids deserializing the task's arguments.'''
+        if files is not None:
+            return files
+
+        _, ser_kwargs = self.fx_serializer.unpack_buffers(payload)
+        kwargs = self.fx_serializer.deserialize(ser_kwargs)
+        return kwargs.get('_globus_files', {})
+
+    def _from_cache(self, cache_key):
+        '''Create a task id for a submission whose result is either cached or
+        already being computed, or return None if neither is the case.'''
+
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            data, endpoint = cached
+            task_id = str(uuid.uuid4())
+            self._task_id_translation[task_id] = set()
+            self._latest_status[task_id] = data
+            self._retention.add(task_id)
+            logger.info('Using cached result for task id {}'.format(task_id))
+            return task_id, endpoint
+
+        primary = self._result_cache.in_flight(cache_key)
+        if primary is not None:
+            task_id = str(uuid.uuid4())
+            # Share the real task ids of the task computing this result
+            self._task_id_translation[task_id] = \
+                self._task_id_translation[primary]
+            self._aliases[task_id] = primary
+            self._retention.add(task_id)
+            logger.info('Task id {} is a duplicate of in-flight task id {}'
+                        .format(task_id, primary))
+            return task_id, self._endpoints_sent_to[primary][-1]
+
+        return None
+
     def _schedule_task(self, func, payload, headers, files,
-                       task_id=None):
+                       task_id=None, cache_key=None):
 
         # If this is the first time scheduling this task_id
         # (i.e., non-backup task), record the necessary metadata
@@ -177,39 +439,58 @@ class CentralScheduler(object):
 
             # Store task information
             self._task_id_translation[task_id] = set()
+            self._payloads.put(task_id, payload)
 
             # Information required to schedule the task, now and in the future
-            info = {
-                'function_id': func,
-                'payload': payload,
-                'headers': headers,
-                'files': files,
-                'time_requested': time.time()
-            }
+            info = TaskRecord(function_id=func,
+                              payload_size=len(payload),
+                              headers=headers,
+                              files=files,
+                              time_requested=time.time(),
+                              cache_key=cache_key)
             self._task_info[task_id] = info
+            if cache_key is not None:
+                self._result_cache.start(cache_key, task_id)
 
-        # TODO: do not choose a dead endpoint (reliably)
-        # exclude = self._blocked[func] | self._dead_endpoints | set(self._endpoints_sent_to[task_id])  # noqa
+        decision_start = time.perf_counter()
+
+        # Strategies avoid dead endpoints, unless all endpoints seem dead
         if len(self._dead_endpoints) > 0:
-            logger.warn('{} endpoints seem dead. Hope they still work!'
-                        .format(len(self._dead_endpoints)))
+            logger.debug('{} endpoints seem dead'
+                         .format(len(self._dead_endpoints)))
         exclude = self._blocked[func] | set(self._endpoints_sent_to[task_id])
+        # Avoid unhealthy endpoints, unless no other endpoints are left
+        unhealthy = self._health.excluded()
+        if len(exclude | unhealthy) < len(self._endpoints):
+            exclude |= unhealthy
         choice = self.strategy.choose_endpoint(func, payload=payload,
                                                files=files,
                                                exclude=exclude,
                                                transfer_ETAs=self._transfer_ETAs)  # noqa
         endpoint = choice['endpoint']
+        self._health.record_scheduled(endpoint)
         logger.info('Choosing endpoint {} for func {}, task id {}'
                     .format(endpoint_name(endpoint), func, task_id))
         choice['ETA'] = self.strategy.predict_ETA(func, endpoint, payload,
                                                   files=files)
+        self._decision_time.observe(time.perf_counter() - decision_start)
 
         # Start Globus transfer of required files, if any
         if len(files) > 0:
-            transfer_num = self._transfer_manger.transfer(files, endpoint,
-                                                          task_id)
+            if self._prefetcher is not None:
+                self._prefetcher.record(func, endpoint, files)
+            # Do not evict the files from the endpoint until the task is done
+            self._transfer_manger.replicas.pin(endpoint, files)
+            # Transfers needed by tasks expected to finish first go first
+            transfer_time = self.transfer_time(files, endpoint,
+                                               queue_wait=False)
+            queue_wait = self._transfer_manger.expected_wait(
+                priority=choice['ETA'])
+            transfer_num = self._transfer_manger.transfer(
+                files, endpoint, task_id, predicted_time=transfer_time,
+                priority=choice['ETA'])
             if transfer_num is not None:
-                transfer_ETA = time.time() + self.transfer_time(files, endpoint)
+                transfer_ETA = time.time() + queue_wait + transfer_time
                 self._transfer_ETAs[endpoint][transfer_num] = transfer_ETA
         else:
             transfer_num = None
@@ -225,39 +506,55 @@ class CentralScheduler(object):
                         .format(endpoint_name(endpoint)))
 
         # Schedule task for sending to FuncX
+        self._payloads.acquire(task_id)
         self._endpoints_sent_to[task_id].append(endpoint)
-        self._scheduled_tasks.put((task_id, endpoint, transfer_num))
+        self._scheduled_tasks.put((task_id, endpoint, transfer_num,
+                                   time.time()))
 
         return task_id, endpoint
 
     def translate_task_id(self, task_id):
-        return self._task_id_translation[task_id]
+        # Tasks which finished a long time ago may have been forgotten
+        return self._task_id_translation.get(task_id, set())
 
     def log_status(self, real_task_id, data):
+        if real_task_id in self._abandoned:
+            self._record_late(real_task_id, data)
+            return
+
         if real_task_id not in self._pending:
             logger.warn('Ignoring unknown task id {}'.format(real_task_id))
             return
 
-        task_id = self._pending[real_task_id]['task_id']
-        func = self._pending[real_task_id]['function_id']
-        endpoint = self._pending[real_task_id]['endpoint_id']
+        task_id = self._pending[real_task_id].task_id
+        func = self._pending[real_task_id].function_id
+        endpoint = self._pending[real_task_id].endpoint_id
+        cache_key = self._pending[real_task_id].cache_key
         # Don't overwrite latest status if it is a result/exception
         if task_id not in self._latest_status or \
                 self._latest_status[task_id].get('status') == 'PENDING':
             self._latest_status[task_id] = data
 
         if 'result' in data:
-            result = self.fx_serializer.deserialize(data['result'])
-            runtime = result['runtime']
-            name = endpoint_name(endpoint)
-            logger.info('Got result from {} for task {} with time {}'
-                        .format(name, real_task_id, runtime))
+            # Result is already being processed by a worker process
+            if real_task_id in self._awaiting_metadata:
+                return
+
+            if self._result_pool is None:
+                result = self.fx_serializer.deserialize(data['result'])
+                self._record_result(real_task_id, result['runtime'],
+                                    result['imports'])
+            else:
+                self._awaiting_metadata.add(real_task_id)
+                future = self._result_pool.submit(_result_metadata,
+                                                  data['result'])
+                future.add_done_callback(self._defer(partial(
+                    self._on_result_metadata, real_task_id, time.time())))
 
-            self.runtime.update(self._pending[real_task_id], runtime)
-            self._pending[real_task_id]['runtime'] = runtime
-            self._record_completed(real_task_id)
-            self.last_result_time[endpoint] = time.time()
-            self._imports[endpoint] = result['imports']
+            if cache_key is not None:
+                self._result_cache.put(cache_key, (data, endpoint),
+                                       len(data['result']))
+                self._result_cache.finish(cache_key)
 
         elif 'exception' in data:
             exception = self.fx_serializer.deserialize(data['exception'])
@@ -269,6 +566,11 @@ class CentralScheduler(object):
                 exc_type, _, _ = sys.exc_info()
                 if exc_type in BLOCK_ERRORS:
                     self.block(func, endpoint)
+            self._health.record_exception(endpoint)
+
+            # Do not cache failures, so that the task can be retried
+            if cache_key is not None:
+                self._result_cache.finish(cache_key)
 
             self._record_completed(real_task_id)
             self.last_result_time[endpoint] = time.time()
@@ -279,18 +581,120 @@ class CentralScheduler(object):
         else:
             logger.error('Unexpected status message: {}'.format(data))
 
+    def _record_result(self, real_task_id, runtime, imports,
+                       completion_time=None):
+        completion_time = completion_time or time.time()
+        endpoint = self._pending[real_task_id].endpoint_id
+        name = endpoint_name(endpoint)
+        logger.info('Got result from {} for task {} with time {}'
+                    .format(name, real_task_id, runtime))
+
+        self.runtime.update(self._pending[real_task_id], runtime)
+        self._pending[real_task_id].runtime = runtime
+        self._health.record_success(endpoint)
+        self._record_completed(real_task_id, completion_time)
+        self.last_result_time[endpoint] = completion_time
+        self._record_imports(endpoint, imports)
+
+    def _record_imports(self, endpoint, imports):
+        '''Workers report the packages a task imported, either as a list or
+        as a dict of package -> seconds taken to import it. Times are only
+        learned from packages which were not loaded on the endpoint yet,
+        since importing a loaded package is almost free.'''
+        if isinstance(imports, dict):
+            loaded = self._imports[endpoint]
+            for pkg, import_time in imports.items():
+                if pkg not in loaded:
+                    self.import_predictor.record(pkg, endpoint, import_time)
+        self._imports[endpoint] = list(imports)
+
+    def _on_result_metadata(self, real_task_id, completion_time, future):
+        self._awaiting_metadata.discard(real_task_id)
+        if real_task_id not in self._pending:
+            return
+
+        try:
+            runtime, imports = future.result()
+        except Exception as e:
+            logger.error('Could not read result metadata of task {}: {}'
+                         .format(real_task_id, e))
+            endpoint = self._pending[real_task_id].endpoint_id
+            self._record_completed(real_task_id, completion_time)
+            self.last_result_time[endpoint] = completion_time
+            return
+
+        self._record_result(real_task_id, runtime, imports, completion_time)
+
+    def _record_late(self, real_task_id, data):
+        '''Record the result of a task copy that lost to another copy.'''
+        if 'result' not in data and 'exception' not in data:
+            return
+
+        now = time.time()
+        info = self._abandoned.pop(real_task_id)
+        logger.info('Got late result for abandoned task {} after {:.3f} s'
+                    .format(real_task_id, now - info.time_abandoned))
+
+        # If the original copy lost, the backup saved this much time
+        self.hedging_stats['wasted_time'] += now - info.time_abandoned
+        if self._endpoints_sent_to[info.task_id][:1] == [info.endpoint_id]:
+            self.hedging_stats['latency_saved'] += now - info.time_abandoned
+
+        if self.ignore_late_results or 'result' not in data:
+            return
+
+        def update_runtime(future):
+            if future.exception() is None:
+                runtime, _ = future.result()
+                self.runtime.update(info, runtime)
+
+        if self._result_pool is None:
+            result = self.fx_serializer.deserialize(data['result'])
+            self.runtime.update(info, result['runtime'])
+        else:
+            future = self._result_pool.submit(_result_metadata,
+                                              data['result'])
+            future.add_done_callback(self._defer(update_runtime))
+
+    def _defer(self, handler):
+        '''Callback for a future of the result pool, which has handler(future)
+        run by the task watchdog.'''
+        def callback(future):
+            self._finished_metadata.put(partial(handler, future))
+            self._task_wakeup.set()
+        return callback
+
+    def _handle_finished_metadata(self):
+        while True:
+            try:
+                handler = self._finished_metadata.get_nowait()
+            except Empty:
+                return
+            try:
+                handler()
+            except Exception as e:
+                logger.error('Could not handle result metadata: {}'
+                             .format(e))
+
     def get_status(self, task_id):
+        # Duplicate tasks report the status of the task computing their result
+        task_id = self._aliases.get(task_id, task_id)
+
         if task_id not in self._task_id_translation:
             logger.warn('Unknown client task id {}'.format(task_id))
+            return {
+                'status': 'Failed',
+                'reason': 'Unknown task id {}'.format(task_id)
+            }
+
+        elif task_id in self._latest_status:
+            return self._latest_status[task_id]
 
         elif len(self._task_id_translation[task_id]) == 0:
             return {'status': 'PENDING'}  # Task has not been scheduled yet
 
-        elif task_id not in self._latest_status:
-            return {'status': 'PENDING'}  # Status has not been queried yet
-
         else:
-            return self._latest_status[task_id]
+            return {'status': 'PENDING'}  # Status has not been queried yet
 
     def queue_delay(self, endpoint):
         # Otherwise, queue delay is the ETA of most recent task,
@@ -300,41 +704,158 @@ class CentralScheduler(object):
         delay = self._last_task_ETA[endpoint] + self._queue_error[endpoint]
         return max(delay, time.time())
 
-    def _record_completed(self, real_task_id):
+    def _record_completed(self, real_task_id, completion_time=None):
+        completion_time = completion_time or time.time()
         info = self._pending[real_task_id]
-        endpoint = info['endpoint_id']
+        endpoint = info.endpoint_id
 
         # If this is the last pending task on this endpoint, reset ETA offset
         if len(self._pending_by_endpoint[endpoint]) == 1:
             self._last_task_ETA[endpoint] = 0.0
             self._queue_error[endpoint] = 0.0
         else:
-            prediction_error = time.time() - self._pending[real_task_id]['ETA']
+            prediction_error = completion_time - info.ETA
             self._queue_error[endpoint] = prediction_error
+            self._health.record_prediction_error(endpoint, prediction_error,
+                                                 info.ETA - info.time_sent)
             # print(colored(f'Prediction error {prediction_error}', 'red'))
 
-        info['ATA'] = time.time()
-        del info['headers']
+        info.ATA = completion_time
         self.execution_log.append(info)
+        self._prediction_error.observe(abs(completion_time - info.ETA),
+                                       info.function_id,
+                                       self._endpoints[endpoint]['group'])
 
         logger.info('Task exec time: expected = {:.3f}, actual = {:.3f}'
-                    .format(info['ETA'] - info['time_sent'],
-                            time.time() - info['time_sent']))
+                    .format(info.ETA - info.time_sent,
+                            completion_time - info.time_sent))
         # logger.info(f'ETA_offset = {self._queue_error[endpoint]:.3f}')
 
         # Stop tracking this task
         del self._pending[real_task_id]
         self._pending_by_endpoint[endpoint].remove(real_task_id)
-        if info['task_id'] in self._task_info:
-            del self._task_info[info['task_id']]
+        self._unpin_files(info)
+        if info.task_id in self._task_info:
+            del self._task_info[info.task_id]
+            self._payloads.release(info.task_id)
+            self._retention.add(info.task_id)
+            self._abandon_copies(info, completion_time)
+
+    def _abandon_copies(self, winner, completion_time):
+        '''Stop accounting for other pending copies of a completed task.'''
+        task_id = winner.task_id
+        copies = [r for r in self._task_id_translation[task_id]
+                  if r in self._pending]
+        if len(self._endpoints_sent_to[task_id]) > 1:
+            self.hedging_stats['hedged_tasks'] += 1
+            if self._endpoints_sent_to[task_id][0] != winner.endpoint_id:
+                self.hedging_stats['backups_won'] += 1
+
+        for real_task_id in copies:
+            info = self._pending.pop(real_task_id)
+            endpoint = info.endpoint_id
+            self._pending_by_endpoint[endpoint].discard(real_task_id)
+            self._reset_last_task_ETA(endpoint)
+            self._unpin_files(info)
+
+            info.time_abandoned = completion_time
+            self._abandoned[real_task_id] = info
+            self.hedging_stats['abandoned_copies'] += 1
+            self.hedging_stats['wasted_time'] += \
+                completion_time - info.time_sent
+            # FuncX does not support canceling tasks, so the copy keeps
+            # running on the endpoint
+            logger.info('Abandoned task {} on {} since task {} finished'
+                        .format(real_task_id, endpoint_name(endpoint),
+                                task_id))
+
+    def _unpin_files(self, info):
+        '''Allow files staged for a task copy to be evicted again.'''
+        if len(info.files) > 0:
+            self._transfer_manger.replicas.unpin(info.endpoint_id, info.files)
+
+    def _rebind(self, info, scheduled):
+        '''Move a task copy which is about to be sent to the endpoint
+        predicted to finish it first, among those which already have its
+        files, if it is sooner than its current endpoint by a margin.
+
+        scheduled holds all copies which have not been sent yet.'''
+        func, current = info.function_id, info.endpoint_id
+        payload = self._payloads.get(info.task_id)
+
+        candidates = set(self._endpoints)
+        for src, pairs in info.files.items():
+            for path, _ in pairs:
+                candidates &= \
+                    self._transfer_manger.replicas.locations(path) | {src}
+
+        others = set(self._endpoints_sent_to[info.task_id]) - {current}
+        exclude = self._blocked[func] | others
+        # As when scheduling, avoid dead or unhealthy endpoints if possible
+        unhealthy = self._health.excluded() | self._dead_endpoints
+        if len(exclude | unhealthy) < len(self._endpoints):
+            exclude |= unhealthy
+        candidates -= exclude
+        if len(candidates - {current}) == 0:
+            return
+
+        ETAs = {e: self.strategy.predict_ETA(func, e, payload)
+                for e in candidates}
+        # Tasks without files were counted in their endpoint's queue when
+        # they were scheduled, so don't make them wait behind themselves
+        if len(info.files) == 0 and current in ETAs:
+            ETAs[current] -= self.runtime(
+                func=func, group=self._endpoints[current]['group'],
+                payload=payload)
+
+        best = min(ETAs, key=ETAs.get)
+        if current in ETAs and ETAs[best] + self.rebind_margin > ETAs[current]:
+            return
+
+        logger.info('Rebinding task {} from {} to {} (ETA {:.2f}s sooner)'
+                    .format(info.task_id, endpoint_name(current),
+                            endpoint_name(best),
+                            ETAs.get(current, ETAs[best]) - ETAs[best]))
+        sent_to = self._endpoints_sent_to[info.task_id]
+        sent_to[len(sent_to) - 1 - sent_to[::-1].index(current)] = best
+        self._unpin_files(info)
+        info.endpoint_id = best
+        if len(info.files) > 0:
+            self._transfer_manger.replicas.pin(best, info.files)
+
+        self._health.record_scheduled(best)
+        self._reset_last_task_ETA(current)
+        # Undo the effects of placing the copy on its old endpoint, unless
+        # another copy still needs that endpoint
+        if len(self._pending_by_endpoint[current]) == 0 \
+                and all(other.endpoint_id != current
+                        for other in scheduled.values()):
+            if self.temperature[current] == 'WARMING':
+                self.temperature[current] = 'COLD'
+                self._warming_since.pop(current, None)
+            self._health.cancel_probe(current)
+        self._last_task_ETA[best] = ETAs[best]
+        if self.temperature[best] == 'COLD':
+            self.temperature[best] = 'WARMING'
+
+    def _reset_last_task_ETA(self, endpoint):
+        if len(self._pending_by_endpoint[endpoint]) == 0:
+            self._last_task_ETA[endpoint] = 0.0
+            self._queue_error[endpoint] = 0.0
+        else:
+            pending = self._pending_by_endpoint[endpoint]
+            self._last_task_ETA[endpoint] = max(self._pending[r].ETA
+                                                for r in pending)
 
     def cold_start(self, endpoint, func):
         # If endpoint is warm, there is no launch time
         if self.temperature[endpoint] != 'COLD':
             launch_time = 0.0
-        # Otherwise, return the launch time in the endpoint config
-        elif 'launch_time' in self._endpoints[endpoint]:
-            launch_time = self._endpoints[endpoint]['launch_time']
+        # Otherwise, predict it from past launches, or use the launch time
+        # in the endpoint config until the endpoint has been launched
+        elif self.launch_predictor.has_learned(endpoint) \
+                or 'launch_time' in self._endpoints[endpoint]:
+            launch_time = self.launch_predictor(endpoint)
         else:
             logger.warn('Endpoint {} should always be warm, but is cold'
                         .format(endpoint_name(endpoint)))
@@ -354,47 +875,79 @@ class CentralScheduler(object):
         logger.info('Starting task-watchdog thread')
 
         scheduled = {}
+        time_scheduled = {}
 
         while True:
 
-            time.sleep(self._task_watchdog_sleep)
+            self._task_wakeup.wait(self._task_watchdog_sleep)
+            self._task_wakeup.clear()
+
+            self._handle_finished_metadata()
 
             # Get newly scheduled tasks
             while True:
                 try:
-                    task_id, end, num = self._scheduled_tasks.get_nowait()
+                    task_id, end, num, t = \
+                        self._scheduled_tasks.get_nowait()
                     if task_id not in self._task_info:
                         logger.warn('Task id {} scheduled but no info found'
                                     .format(task_id))
+                        self._payloads.release(task_id)
                         continue
+                    if task_id in scheduled:  # Replaced by a newer copy
+                        self._discard_copy(scheduled[task_id])
                     info = self._task_info[task_id]
-                    scheduled[task_id] = dict(info)  # Create new copy of info
-                    scheduled[task_id]['task_id'] = task_id
-                    scheduled[task_id]['endpoint_id'] = end
-                    scheduled[task_id]['transfer_num'] = num
+                    scheduled[task_id] = info.copy()  # Create new copy of info
+                    scheduled[task_id].task_id = task_id
+                    scheduled[task_id].endpoint_id = end
+                    scheduled[task_id].transfer_num = num
+                    time_scheduled[task_id] = t
                 except Empty:
                     break
 
+            # Drop copies of tasks which were completed by another copy
+            for task_id in [t for t in scheduled if t not in self._task_info]:
+                self._discard_copy(scheduled.pop(task_id))
+                del time_scheduled[task_id]
+
             # Filter out all tasks whose data transfer has not been completed
             ready_to_send = set()
+            failed = set()
             for task_id, info in scheduled.items():
-                transfer_num = info['transfer_num']
+                transfer_num = info.transfer_num
                 if transfer_num is None:
                     ready_to_send.add(task_id)
-                    info['transfer_time'] = 0.0
+                    info.transfer_time = 0.0
                 elif self._transfer_manger.is_complete(transfer_num):
+                    if self._transfer_manger.has_failed(transfer_num):
+                        failed.add(task_id)
+                        continue
                     ready_to_send.add(task_id)
-                    del self._transfer_ETAs[info['endpoint_id']][transfer_num]
-                    info['transfer_time'] = self._transfer_manger.get_transfer_time(transfer_num)  # noqa
+                    self._transfer_wait.observe(
+                        time.time() - time_scheduled[task_id])
+                    del self._transfer_ETAs[info.endpoint_id][transfer_num]
+                    info.transfer_time = self._transfer_manger.get_transfer_time(transfer_num)  # noqa
+                    self._transfer_manger.release(transfer_num)
                 else:  # This task cannot be scheduled yet
                     continue
 
+            # Copies whose files could not be transferred cannot run
+            for task_id in failed:
+                self._discard_copy(scheduled.pop(task_id))
+                del time_scheduled[task_id]
+                self._fail_task(task_id, 'Could not transfer input files')
+
+            self._num_waiting = len(scheduled)
             if len(ready_to_send) == 0:
                 logger.debug('No new tasks to send. Task watchdog sleeping...')
                 continue
 
+            if self.late_binding:
+                for task_id in ready_to_send:
+                    self._rebind(scheduled[task_id], scheduled)
+
             # TODO: different clients send different headers. change eventually
-            headers = list(scheduled.values())[0]['headers']
+            headers = list(scheduled.values())[0].headers
 
             logger.info('Scheduling a batch of {} tasks'
                         .format(len(ready_to_send)))
@@ -403,20 +956,24 @@ class CentralScheduler(object):
             data = {'tasks': []}
             for task_id in ready_to_send:
                 info = scheduled[task_id]
-                submit_info = (info['function_id'], info['endpoint_id'],
-                               info['payload'])
+                submit_info = (info.function_id, info.endpoint_id,
+                               self._payloads.get(task_id))
                 data['tasks'].append(submit_info)
 
-            res_str = requests.post(f'{FUNCX_API}/submit', headers=headers,
-                                    data=json.dumps(data))
+            with self._submit_time.time():
+                res_str = requests.post(f'{self.funcx_api}/submit',
+                                        headers=headers,
+                                        data=json.dumps(data))
             try:
                 res = res_str.json()
             except ValueError:
                 logger.error(f'Could not parse JSON from {res_str.text}')
-                continue
+                res = {'status': 'Failed'}
             if res['status'] != 'Success':
                 logger.error('Could not send tasks to FuncX. Got response: {}'
                              .format(res))
+                for end in {scheduled[t].endpoint_id for t in ready_to_send}:
+                    self._health.record_submit_failure(end)
                 continue
 
             # Update task info with submission info
@@ -424,25 +981,34 @@ class CentralScheduler(object):
                 info = scheduled[task_id]
                 # This ETA calculation does not take into account transfer time
                 # since, at this point, the transfer has already completed.
-                info['ETA'] = self.strategy.predict_ETA(info['function_id'],
-                                                        info['endpoint_id'],
-                                                        info['payload'])
+                info.ETA = self.strategy.predict_ETA(
+                    info.function_id, info.endpoint_id,
+                    self._payloads.get(task_id))
                 # Record if this ETA prediction is "reliable". If it is not
                 # (e.g., when we have not learned about this (func, ep) pair),
                 # backup tasks will not be sent for this task if it is delayed.
-                info['is_ETA_reliable'] = self.runtime.has_learned(
-                    info['function_id'], info['endpoint_id'])
+                info.is_ETA_reliable = self.runtime.has_learned(
+                    info.function_id, info.endpoint_id)
 
-                info['time_sent'] = time.time()
+                info.time_sent = time.time()
+                self._queued_time.observe(
+                    info.time_sent - time_scheduled.pop(task_id))
 
-                endpoint = info['endpoint_id']
+                endpoint = info.endpoint_id
                 self._task_id_translation[task_id].add(real_task_id)
 
                 self._pending[real_task_id] = info
                 self._pending_by_endpoint[endpoint].add(real_task_id)
 
                 # Record endpoint ETA for queue-delay prediction
-                self._last_task_ETA[endpoint] = info['ETA']
+                self._last_task_ETA[endpoint] = info.ETA
+
+                # Launch times are measured from when the first task is sent
+                # to a warming endpoint until it has active managers
+                if self.temperature[endpoint] == 'WARMING':
+                    self._warming_since.setdefault(endpoint, info.time_sent)
+
+                self._set_backup_timer(real_task_id, info)
 
                 logger.info('Sent task id {} to {} with real task id {}'
                             .format(task_id, endpoint_name(endpoint),
@@ -451,83 +1017,281 @@ class CentralScheduler(object):
             # Stop tracking all newly sent tasks
             for task_id in ready_to_send:
                 del scheduled[task_id]
+                self._payloads.release(task_id)
+
+    def _discard_copy(self, info):
+        '''Release what a scheduled copy of a task holds, when it will not
+        be sent.'''
+        if info.transfer_num is not None:
+            self._transfer_ETAs[info.endpoint_id].pop(info.transfer_num, None)
+            self._transfer_manger.release(info.transfer_num)
+        self._payloads.release(info.task_id)
+        self._unpin_files(info)
+
+    def _fail_task(self, task_id, reason):
+        '''Report a task as failed to its client, unless another copy of
+        it may still complete.'''
+        if task_id not in self._task_info:
+            return
+        if any(r in self._pending for r in self.translate_task_id(task_id)):
+            return
+
+        logger.error('Task {} failed: {}'.format(task_id, reason))
+        info = self._task_info.pop(task_id)
+        self._latest_status[task_id] = {'status': 'Failed', 'reason': reason}
+        self._payloads.release(task_id)
+        self._retention.add(task_id)
+        if info.cache_key is not None:
+            self._result_cache.finish(info.cache_key)
 
     def _check_endpoints(self):
         logger.info('Starting endpoint-watchdog thread')
 
+        pool = ThreadPoolExecutor(max_workers=POLL_WORKERS)
+        next_poll = {end: 0.0 for end in self._endpoints}
+        interval = {end: MIN_POLL_INTERVAL for end in self._endpoints}
+        futures = {}  # Polls in flight, which may outlive a round
+
         while True:
-            for end in self._endpoints.keys():
-                statuses = self._fxc.get_endpoint_status(end)
-                if len(statuses) == 0:
-                    logger.warn('Endpoint {} does not have any statuses'
-                                .format(endpoint_name(end)))
+            now = time.time()
+            polling = set(futures.values())
+            for end, t in next_poll.items():
+                if t <= now and end not in polling:
+                    future = pool.submit(self._fxc.get_endpoint_status, end)
+                    futures[future] = end
+
+            done = []
+            try:
+                for future in as_completed(futures, timeout=POLL_TIMEOUT):
+                    done.append(future)
+            except TimeoutError:
+                logger.warn('Status of endpoints {} is taking more than '
+                            '{:.0f} seconds'.format(
+                                [endpoint_name(futures[f]) for f in futures
+                                 if not f.done()], POLL_TIMEOUT))
+
+            for future in done:
+                end = futures.pop(future)
+                try:
+                    is_stable = self._update_endpoint(end, future.result())
+                except Exception as e:
+                    logger.error('Could not get status of endpoint {}: {}'
+                                 .format(endpoint_name(end), e))
+                    is_stable = False
+
+                if is_stable:
+                    interval[end] = min(1.5 * interval[end],
+                                        MAX_POLL_INTERVAL)
                 else:
-                    status = statuses[0]  # Most recent endpoint status
-
-                    # Mark endpoint as dead/alive based on heartbeat's age
-                    # Heartbeats are delayed when an endpoint is executing
-                    # tasks, so take into account last execution too
-                    age = time.time() - max(status['timestamp'],
-                                            self.last_result_time[end])
-                    is_dead = end in self._dead_endpoints
-                    if not is_dead and age > HEARTBEAT_THRESHOLD:
-                        self._dead_endpoints.add(end)
-                        logger.warn('Endpoint {} seems to have died! '
-                                    'Last heartbeat was {:.2f} seconds ago.'
-                                    .format(endpoint_name(end), age))
-                    elif is_dead and age <= HEARTBEAT_THRESHOLD:
-                        self._dead_endpoints.remove(end)
-                        logger.warn('Endpoint {} is back alive! '
-                                    'Last heartbeat was {:.2f} seconds ago.'
-                                    .format(endpoint_name(end), age))
-
-                    # Mark endpoint as "cold" or "warm" depending on if it
-                    # has active managers (nodes) allocated to it
-                    if self.temperature[end] == 'WARM' \
-                            and status['active_managers'] == 0:
-                        self.temperature[end] = 'COLD'
-                        logger.info('Endpoint {} is cold!'
-                                    .format(endpoint_name(end)))
-                    elif self.temperature[end] != 'WARM' \
-                            and status['active_managers'] > 0:
-                        self.temperature[end] = 'WARM'
-                        logger.info('Endpoint {} is warm again!'
-                                    .format(endpoint_name(end)))
-
-            # Send backup tasks if needed
-            self._send_backups_if_needed()
-
-            # Sleep before checking statuses again
-            time.sleep(5)
-
-    def _send_backups_if_needed(self):
-        # Get all tasks which have not been completed yet and still have a
-        # pending (real) task on a dead endpoint
-        task_ids = {
-            self._pending[real_task_id]['task_id']
-            for endpoint in self._dead_endpoints
-            for real_task_id in self._pending_by_endpoint[endpoint]
-            if self._pending[real_task_id]['task_id'] in self._task_info
-        }
+                    interval[end] = MIN_POLL_INTERVAL
+                next_poll[end] = time.time() + interval[end]
+
+            # Send backups of tasks still pending on dead endpoints
+            self._send_backups_if_needed([
+                real_task_id
+                for endpoint in list(self._dead_endpoints)
+                for real_task_id in list(self._pending_by_endpoint[endpoint])
+            ])
+
+            # Sleep until the next endpoint should be checked. Endpoints
+            # still being polled are waited on by the next round instead
+            polling = set(futures.values())
+            idle = [t for (end, t) in next_poll.items() if end not in polling]
+            time.sleep(max(min(idle, default=0.0) - time.time(), 0.0))
+
+    def _update_endpoint(self, end, statuses):
+        '''Update the liveness and temperature of an endpoint from its
+        statuses, and return whether its state seems stable.'''
+
+        if len(statuses) == 0:
+            logger.warn('Endpoint {} does not have any statuses'
+                        .format(endpoint_name(end)))
+            return False
+
+        status = statuses[0]  # Most recent endpoint status
+        is_stable = True
+
+        # Mark endpoint as dead/alive based on heartbeat's age
+        # Heartbeats are delayed when an endpoint is executing
+        # tasks, so take into account last execution too
+        age = time.time() - max(status['timestamp'],
+                                self.last_result_time[end])
+        self._health.record_heartbeat(end, age)
+        is_dead = end in self._dead_endpoints
+        if not is_dead and age > HEARTBEAT_THRESHOLD:
+            self._dead_endpoints.add(end)
+            self.strategy.endpoint_changed(end, 'dead')
+            logger.warn('Endpoint {} seems to have died! '
+                        'Last heartbeat was {:.2f} seconds ago.'
+                        .format(endpoint_name(end), age))
+            is_stable = False
+        elif is_dead and age <= HEARTBEAT_THRESHOLD:
+            self._dead_endpoints.remove(end)
+            self.strategy.endpoint_changed(end, 'alive')
+            logger.warn('Endpoint {} is back alive! '
+                        'Last heartbeat was {:.2f} seconds ago.'
+                        .format(endpoint_name(end), age))
+            is_stable = False
+        elif age > HEARTBEAT_THRESHOLD / 2:
+            is_stable = False  # Endpoint may be about to die
+
+        # Mark endpoint as "cold" or "warm" depending on if it
+        # has active managers (nodes) allocated to it
+        if self.temperature[end] == 'WARM' \
+                and status['active_managers'] == 0:
+            self.temperature[end] = 'COLD'
+            self._warming_since.pop(end, None)
+            self.strategy.endpoint_changed(end, 'cold')
+            logger.info('Endpoint {} is cold!'
+                        .format(endpoint_name(end)))
+            is_stable = False
+        elif self.temperature[end] != 'WARM' \
+                and status['active_managers'] > 0:
+            if self.temperature[end] == 'WARMING' \
+                    and end in self._warming_since:
+                launch_time = time.time() - self._warming_since.pop(end)
+                self.launch_predictor.record(end, launch_time)
+                logger.info('Endpoint {} launched in {:.2f} seconds'
+                            .format(endpoint_name(end), launch_time))
+            self.temperature[end] = 'WARM'
+            self.strategy.endpoint_changed(end, 'warm')
+            logger.info('Endpoint {} is warm again!'
+                        .format(endpoint_name(end)))
+            is_stable = False
+        elif self.temperature[end] == 'WARMING':
+            is_stable = False  # Endpoint should become warm soon
+
+        return is_stable
+
+    def _set_backup_timer(self, real_task_id, info):
+        # If the predicted ETA wasn't reliable, don't send backups
+        if self.max_backups == 0 or not info.is_ETA_reliable:
+            return
 
-        # Get all tasks for which we had ETA-predictions but haven't
-        # been completed even past their ETA
-        for real_task_id, info in self._pending.items():
-            # If the predicted ETA wasn't reliable, don't send backups
-            if not info['is_ETA_reliable']:
-                continue
+        expected = info.ETA - info.time_sent
+        if expected <= 0:
+            return
+        deadline = info.time_sent + self.backup_delay_threshold * expected
 
-            expected = info['ETA'] - info['time_sent']
-            elapsed = time.time() - info['time_sent']
+        with self._backup_cv:
+            # Drop timers of completed tasks if they make up most of the heap
+            if len(self._backup_deadlines) > 2 * len(self._pending) + 1024:
+                self._backup_deadlines = [x for x in self._backup_deadlines
+                                          if x[1] in self._pending]
+                heapq.heapify(self._backup_deadlines)
 
-            if elapsed / expected > self.backup_delay_threshold:
-                task_ids.add(info['task_id'])
+            heapq.heappush(self._backup_deadlines, (deadline, real_task_id))
+            # Wake up the backup watchdog if this is the earliest deadline
+            if self._backup_deadlines[0][1] == real_task_id:
+                self._backup_cv.notify()
+
+    def _watch_deadlines(self):
+        logger.info('Starting backup-watchdog thread')
+
+        while True:
+            with self._backup_cv:
+                while len(self._backup_deadlines) == 0 or \
+                        self._backup_deadlines[0][0] > time.time():
+                    timeout = None
+                    if len(self._backup_deadlines) > 0:
+                        timeout = self._backup_deadlines[0][0] - time.time()
+                    self._backup_cv.wait(timeout)
+
+                # Get all tasks which haven't been completed past their ETA
+                overdue = []
+                while len(self._backup_deadlines) > 0 and \
+                        self._backup_deadlines[0][0] <= time.time():
+                    _, real_task_id = heapq.heappop(self._backup_deadlines)
+                    overdue.append(real_task_id)
+
+            self._send_backups_if_needed(overdue)
+
+    def _send_backups_if_needed(self, real_task_ids):
+        # Get all (virtual) tasks which have not been completed yet
+        task_ids = set()
+        for real_task_id in real_task_ids:
+            info = self._pending.get(real_task_id)
+            if info is not None and info.task_id in self._task_info:
+                task_ids.add(info.task_id)
 
         for task_id in task_ids:
             if len(self._endpoints_sent_to[task_id]) > self.max_backups:
                 logger.debug(f'Skipping sending new backup task for {task_id}')
             else:
                 logger.info(f'Sending new backup task for {task_id}')
+                self.hedging_stats['backups_sent'] += 1
+                self._backups_sent.inc()
                 info = self._task_info[task_id]
-                self._schedule_task(info['function_id'], info['payload'],
-                                    info['headers'], info['files'], task_id)
+                self._schedule_task(info.function_id,
+                                    self._payloads.get(task_id),
+                                    info.headers, info.files, task_id)
+
+    def _collect_garbage(self):
+        logger.info('Starting garbage-collector thread')
+
+        last_save = time.time()
+        while True:
+            time.sleep(GC_INTERVAL)
+
+            now = time.time()
+            if now - last_save >= MODEL_SAVE_INTERVAL:
+                self.save_models()
+                last_save = now
+
+            evicted = 0
+            for task_id in self._retention.expired(now):
+                # Tasks (or the tasks they duplicate) may still be running
+                if self._aliases.get(task_id, task_id) in self._task_info:
+                    self._retention.add(task_id, now)
+                    continue
+
+                for real_task_id in self.translate_task_id(task_id):
+                    self._abandoned.pop(real_task_id, None)
+                self._task_id_translation.pop(task_id, None)
+                self._latest_status.pop(task_id, None)
+                self._endpoints_sent_to.pop(task_id, None)
+                self._aliases.pop(task_id, None)
+                evicted += 1
+
+            self._transfer_manger.collect_garbage(now)
+
+            if evicted > 0:
+                logger.debug('Forgot {} tasks. Memory footprint: {}'
+                             .format(evicted, self.memory_footprint()))
+
+    def _learned_model_file(self, name):
+        if self._model_dir is None:
+            return None
+        return os.path.join(self._model_dir, name)
+
+    def save_models(self):
+        '''Write learned models to model_dir, if it was given.'''
+        if self._model_dir is None:
+            return
+
+        for model, file_name in self._model_files:
+            try:
+                os.makedirs(self._model_dir, exist_ok=True)
+                model.to_file(file_name)
+            except Exception as e:
+                logger.error('Could not save {} to {}: {}'
+                             .format(type(model).__name__, file_name, e))
+
+    def memory_footprint(self):
+        '''Number of entries in each long-lived data structure.'''
+        footprint = {
+            'task_id_translation': len(self._task_id_translation),
+            'latest_status': len(self._latest_status),
+            'endpoints_sent_to': len(self._endpoints_sent_to),
+            'aliases': len(self._aliases),
+            'task_info': len(self._task_info),
+            'pending': len(self._pending),
+            'abandoned': len(self._abandoned),
+            'retained_tasks': len(self._retention),
+            'payloads': len(self._payloads),
+            'payload_bytes': self._payloads.num_bytes,
+            'cached_results': len(self._result_cache),
+            'cached_result_bytes': self._result_cache.num_bytes,
+        }
+        footprint.update(self._transfer_manger.memory_footprint())
+        return footprint
@@ -0,0 +1,77 @@
+import json
+from threading import Lock
+
+
+# Fields of a completed task's info which are written to the log
+LOG_FIELDS = ['task_id', 'function_id', 'endpoint_id', 'payload_size',
+              'time_requested', 'transfer_time', 'time_sent', 'ETA',
+              'is_ETA_reliable', 'ATA', 'runtime']
+
+
+class ExecutionLog(object):
+    '''Append-only log of completed tasks, stored as one JSON record per line.
+
+    Readers pass the byte offset returned by their previous read (0 at
+    first), so any number of consumers can read the log incrementally
+    without the scheduler keeping any history in memory.'''
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._fh = open(file_name, 'ab')
+        self._lock = Lock()
+        self.size = self._fh.tell()
+
+    def append(self, info):
+        record = info.to_dict(LOG_FIELDS)
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            self.size += len(line)
+
+    def check_cursor(self, since):
+        '''Raise ValueError unless offset since is the start of a record.'''
+        if since < 0 or since > self.size:
+            raise ValueError('Cursor {} is outside of the log'.format(since))
+        if since == 0:
+            return
+        with open(self.file_name, 'rb') as fh:
+            fh.seek(since - 1)
+            if fh.read(1) != b'\n':
+                raise ValueError('Cursor {} is not at the start of a record'
+                                 .format(since))
+
+    def read(self, since=0, limit=1000):
+        '''Return up to limit records written after offset since, and the
+        offset to continue reading from.'''
+        self.check_cursor(since)
+        end = self.size
+        records = []
+        with open(self.file_name, 'rb') as fh:
+            fh.seek(since)
+            while since < end and len(records) < limit:
+                line = fh.readline()
+                since += len(line)
+                records.append(json.loads(line))
+
+        return records, since
+
+    def stream(self, since=0, chunk_size=2 ** 16):
+        '''Return a generator of the raw lines written after offset since,
+        and the offset at which the generator stops.'''
+        self.check_cursor(since)
+        end = self.size
+
+        def lines():
+            with open(self.file_name, 'rb') as fh:
+                fh.seek(since)
+                remaining = end - since
+                while remaining > 0:
+                    chunk = fh.read(min(chunk_size, remaining))
+                    if len(chunk) == 0:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return lines(), max(since, end)
@@ -0,0 +1,190 @@
+'''Local fake of the funcX web service and of Globus transfers, to run the
+scheduler without any remote services, e.g., for load testing.
+
+Tasks never run: each one is reported as finished once its duration has
+passed since it was submitted, with a result carrying that duration as
+its runtime.
+
+Run from the repository root, then point the scheduler at it:
+    python fake_funcx.py -p 5001 --duration 1.0 --latency 0.05
+    python run_scheduler.py --fake http://localhost:5001
+'''
+
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import requests
+from threading import Lock
+from flask import Flask, request
+
+from funcx.serialize import FuncXSerializer
+
+
+fake_app = Flask(__name__)
+logging.getLogger('werkzeug').setLevel('ERROR')
+
+
+class FakeFuncX(object):
+    '''Tasks submitted to the fake service, and when they finish.'''
+
+    def __init__(self, duration=1.0, jitter=0.0, durations=None,
+                 latency=0.0, seed=None):
+        self.duration = duration
+        self.jitter = jitter
+        self.durations = durations or {}  # function -> duration
+        self.latency = latency
+        self._rng = random.Random(seed)
+        self._serializer = FuncXSerializer()
+
+        self._tasks = {}  # task id -> (time submitted, duration)
+        self._lock = Lock()
+
+    def submit(self, tasks):
+        now = time.time()
+        task_ids = []
+        with self._lock:
+            for func, endpoint, payload in tasks:
+                duration = self.durations.get(func, self.duration)
+                duration *= 1.0 + self._rng.uniform(-self.jitter, self.jitter)
+                task_id = str(uuid.uuid4())
+                self._tasks[task_id] = (now, duration)
+                task_ids.append(task_id)
+        return task_ids
+
+    def status(self, task_id):
+        if task_id not in self._tasks:
+            return {'status': 'Failed', 'reason': 'Unknown task id'}
+
+        submitted, duration = self._tasks[task_id]
+        if time.time() < submitted + duration:
+            return {'task_id': task_id, 'status': 'PENDING'}
+
+        result = {'result': None, 'runtime': duration, 'imports': []}
+        return {
+            'task_id': task_id,
+            'status': 'SUCCESS',
+            'result': self._serializer.serialize(result),
+            'completion_t': submitted + duration,
+        }
+
+
+FAKE = FakeFuncX()
+
+
+@fake_app.before_request
+def add_latency():
+    if FAKE.latency > 0:
+        time.sleep(FAKE.latency)
+
+
+@fake_app.route('/submit', methods=['POST'])
+def submit():
+    data = json.loads(request.data)
+    tasks = [(t[0], t[1], t[2]) for t in data['tasks']]
+    return json.dumps({'status': 'Success', 'task_uuids': FAKE.submit(tasks)})
+
+
+@fake_app.route('/<task_id>/status', methods=['GET'])
+def status(task_id):
+    return json.dumps(FAKE.status(task_id))
+
+
+@fake_app.route('/batch_status', methods=['POST'])
+def batch_status():
+    task_ids = json.loads(request.data)['task_ids']
+    results = {t: FAKE.status(t) for t in task_ids}
+    return json.dumps({'response': 'batch', 'results': results})
+
+
+@fake_app.route('/register_function', methods=['POST'])
+def register_function():
+    return json.dumps({'function_uuid': str(uuid.uuid4())})
+
+
+@fake_app.route('/endpoints/<endpoint>/status', methods=['GET'])
+def endpoint_status(endpoint):
+    return json.dumps([{'timestamp': time.time(), 'active_managers': 1}])
+
+
+class FakeFuncXClient(object):
+    '''Stands in for FuncXClient, getting endpoint statuses from the fake
+    funcX service.'''
+
+    def __init__(self, funcx_api):
+        self.funcx_api = funcx_api
+
+    def get_endpoint_status(self, endpoint):
+        res = requests.get(f'{self.funcx_api}/endpoints/{endpoint}/status')
+        return res.json()
+
+
+class FakeTransferClient(object):
+    '''Stands in for globus_sdk.TransferClient. Transfers succeed after a
+    fixed time, plus some time per file.'''
+
+    def __init__(self, transfer_time=1.0, time_per_file=0.0):
+        self.transfer_time = transfer_time
+        self.time_per_file = time_per_file
+        self._transfers = {}  # task id -> time it finishes
+        self._lock = Lock()
+
+    def get_submission_id(self):
+        return {'value': str(uuid.uuid4())}
+
+    def submit_transfer(self, data):
+        num_files = len(data['DATA'])
+        task_id = str(uuid.uuid4())
+        with self._lock:
+            self._transfers[task_id] = time.time() + self.transfer_time \
+                + self.time_per_file * num_files
+        return {'code': 'Accepted', 'task_id': task_id}
+
+    def submit_delete(self, data):
+        return {'code': 'Accepted', 'task_id': str(uuid.uuid4())}
+
+    def cancel_task(self, task_id):
+        with self._lock:
+            self._transfers.pop(task_id, None)
+        return {'code': 'Canceled', 'message': ''}
+
+    def task_successful_transfers(self, task_id):
+        return []  # Files are never skipped, see task_list
+
+    def task_list(self, num_results=10, filter=''):
+        # Only filters of the form 'task_id:<id>,<id>,...' are supported
+        task_ids = filter.split(':', 1)[1].split(',')
+        now = time.time()
+        with self._lock:
+            return [{'task_id': t,
+                     'status': 'SUCCEEDED' if self._transfers[t] <= now
+                     else 'ACTIVE',
+                     'files_skipped': 0}
+                    for t in task_ids[:num_results] if t in self._transfers]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=5001)
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='Seconds each task takes to finish')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Relative variation of task durations')
+    parser.add_argument('--function-duration', type=str, action='append',
+                        default=[], help='function_id=seconds')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    durations = {}
+    for x in args.function_duration:
+        func, duration = x.split('=')
+        durations[func] = float(duration)
+
+    FAKE = FakeFuncX(duration=args.duration, jitter=args.jitter,
+                     durations=durations, latency=args.latency,
+                     seed=args.seed)
+    fake_app.run(host='0.0.0.0', port=args.port, threaded=True)
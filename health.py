@@ -0,0 +1,170 @@
+import time
+import logging
+from threading import Lock
+from collections import defaultdict, deque
+
+from utils import colored, endpoint_name
+
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter(
+    colored("[HEALTH]    %(message)s", 'magenta')))
+logger.addHandler(ch)
+
+
+# Circuit-breaker states
+CLOSED = 'CLOSED'  # Endpoint is healthy and can be scheduled to
+OPEN = 'OPEN'  # Endpoint is unhealthy and should not be scheduled to
+HALF_OPEN = 'HALF_OPEN'  # A single probe task may be scheduled to endpoint
+
+HISTORY = 300.0  # Seconds of task outcomes used to compute health
+MIN_OUTCOMES = 3  # Outcomes required before failure rates are trusted
+OUTLIER_FACTOR = 3.0  # Prediction errors larger than this are outliers
+
+
+class EndpointHealth(object):
+    '''Health score of each endpoint, in [0, 1], combining the age of its
+    last heartbeat, recent task exceptions and submission failures, and
+    how often its tasks finish much later than predicted.
+
+    Each endpoint has a circuit breaker which opens when its score is too
+    low. After a cool-down, it half-opens to let a single probe task
+    through, and closes again if that task succeeds. A probe which does
+    not report back in time (e.g., because it was abandoned for a backup,
+    or its result was lost) counts as a failure.'''
+
+    def __init__(self, endpoints, heartbeat_threshold, open_below=0.5,
+                 cooldown=60.0, probe_timeout=300.0, log_level='INFO'):
+        self.endpoints = endpoints
+        self.heartbeat_threshold = heartbeat_threshold
+        self.open_below = open_below
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        logger.setLevel(log_level)
+
+        self._outcomes = defaultdict(deque)  # endpoint -> (time, outcome)
+        self._heartbeat_age = defaultdict(float)
+        self.state = defaultdict(lambda: CLOSED)
+        self._opened_at = {}
+        self._probing = {}  # endpoint -> deadline of its probe task
+        self._lock = Lock()
+
+    def record_heartbeat(self, endpoint, age):
+        with self._lock:
+            self._heartbeat_age[endpoint] = age
+            # Even a probe should not be sent to an endpoint that seems dead
+            if self.state[endpoint] == HALF_OPEN \
+                    and self._heartbeat_score(endpoint) < self.open_below:
+                self._probing.pop(endpoint, None)
+                self._open(endpoint)
+            else:
+                self._update(endpoint)
+
+    def record_success(self, endpoint):
+        self._record(endpoint, 'success')
+
+    def record_exception(self, endpoint):
+        self._record(endpoint, 'exception')
+
+    def record_submit_failure(self, endpoint):
+        self._record(endpoint, 'submit_failure')
+
+    def record_prediction_error(self, endpoint, error, expected):
+        '''Record how much later than predicted a task finished.'''
+        if error > OUTLIER_FACTOR * max(expected, 1.0):
+            self._record(endpoint, 'outlier')
+
+    def record_scheduled(self, endpoint):
+        with self._lock:
+            if self.state[endpoint] == HALF_OPEN \
+                    and endpoint not in self._probing:
+                self._probing[endpoint] = time.time() + self.probe_timeout
+
+    def cancel_probe(self, endpoint):
+        '''Forget the probe of an endpoint whose task was moved elsewhere.'''
+        with self._lock:
+            self._probing.pop(endpoint, None)
+
+    def score(self, endpoint):
+        now = time.time()
+        outcomes = self._outcomes[endpoint]
+        while len(outcomes) > 0 and now - outcomes[0][0] > HISTORY:
+            outcomes.popleft()
+
+        score = self._heartbeat_score(endpoint)
+
+        counts = defaultdict(int)
+        for _, outcome in outcomes:
+            counts[outcome] += 1
+        num_tasks = counts['success'] + counts['exception'] \
+            + counts['submit_failure']
+        if num_tasks >= MIN_OUTCOMES:
+            failures = counts['exception'] + counts['submit_failure']
+            score *= 1.0 - failures / num_tasks
+            score *= 1.0 - 0.5 * min(counts['outlier'] / num_tasks, 1.0)
+
+        return score
+
+    def _heartbeat_score(self, endpoint):
+        # Heartbeats older than half the threshold start lowering the score
+        age = self._heartbeat_age[endpoint] / self.heartbeat_threshold
+        return min(max(2.0 - 2.0 * age, 0.0), 1.0)
+
+    def excluded(self):
+        '''Endpoints which should currently not be scheduled to.'''
+        with self._lock:
+            now = time.time()
+            for endpoint, opened_at in list(self._opened_at.items()):
+                if now - opened_at >= self.cooldown:
+                    self._set_state(endpoint, HALF_OPEN)
+                    del self._opened_at[endpoint]
+
+            for endpoint, deadline in list(self._probing.items()):
+                if now >= deadline:
+                    logger.info('Probe task of {} did not report back'
+                                .format(endpoint_name(endpoint)))
+                    del self._probing[endpoint]
+                    self._open(endpoint)
+
+            return {e for (e, s) in self.state.items()
+                    if s == OPEN or (s == HALF_OPEN and e in self._probing)}
+
+    def summary(self):
+        # Scores are computed from outcomes which other threads append to
+        with self._lock:
+            return {e: {'score': self.score(e), 'state': self.state[e]}
+                    for e in self.endpoints}
+
+    def _record(self, endpoint, outcome):
+        with self._lock:
+            self._outcomes[endpoint].append((time.time(), outcome))
+
+            # Outcome of the probe task of a half-open breaker
+            if self.state[endpoint] == HALF_OPEN \
+                    and endpoint in self._probing and outcome != 'outlier':
+                del self._probing[endpoint]
+                if outcome == 'success':
+                    self._outcomes[endpoint].clear()
+                    self._set_state(endpoint, CLOSED)
+                else:
+                    self._open(endpoint)
+                return
+
+            self._update(endpoint)
+
+    def _update(self, endpoint):
+        if self.state[endpoint] == CLOSED \
+                and self.score(endpoint) < self.open_below:
+            self._open(endpoint)
+
+    def _open(self, endpoint):
+        self._opened_at[endpoint] = time.time()
+        self._set_state(endpoint, OPEN)
+
+    def _set_state(self, endpoint, state):
+        if self.state[endpoint] != state:
+            logger.info('Circuit breaker of {} is now {} (score {:.2f})'
+                        .format(endpoint_name(endpoint), state,
+                                self.score(endpoint)))
+        self.state[endpoint] = state
@@ -0,0 +1,225 @@
+'''Load generator for the scheduler's web service.
+
+Replays client requests recorded by `run_scheduler.py --record` (or a
+synthetic workload) against a running scheduler, at N times their
+original speed, and reports request throughput, latency percentiles and,
+given the scheduler's pid, its CPU usage. Recordings do not include
+request headers, so the scheduler should be run against fake_funcx.py.
+
+Run from the repository root:
+    python load_generator.py --trace recorded.jsonl --speed 10 --pid 1234
+    python load_generator.py --synthetic 2000 --rate 200
+'''
+
+import json
+import time
+import uuid
+import random
+import argparse
+import requests
+from threading import Lock
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def load_trace(file_name):
+    with open(file_name) as fh:
+        records = [json.loads(line) for line in fh]
+    records.sort(key=lambda x: x['time'])
+    return records
+
+
+def synthetic_trace(n, rate, function_id='synthetic', polls=3,
+                    poll_interval=1.0, seed=0):
+    '''Clients submitting n single-task batches at a given rate, each of
+    which then polls the status of its task a few times.'''
+    rng = random.Random(seed)
+    records = []
+    t = 0.0
+    for _ in range(n):
+        t += rng.expovariate(rate)
+        task_id = str(uuid.uuid4())
+        # Files are sent alongside the payload, which is not deserialized
+        task = [function_id, 'UNDECIDED', 'x' * 64, {}]
+        records.append({
+            'time': t,
+            'method': 'POST',
+            'path': '/submit',
+            'body': json.dumps({'tasks': [task]}),
+            'response': json.dumps({'task_uuids': [task_id]}),
+        })
+        for i in range(1, polls + 1):
+            records.append({
+                'time': t + i * poll_interval,
+                'method': 'POST',
+                'path': '/batch_status',
+                'body': json.dumps({'task_ids': [task_id]}),
+            })
+
+    records.sort(key=lambda x: x['time'])
+    return records
+
+
+def route(path):
+    '''Name of the route of a request path, for reporting.'''
+    if path.endswith('/status') and path.count('/') == 2:
+        return '/<task_id>/status'
+    return path
+
+
+class LoadGenerator(object):
+
+    def __init__(self, url, speed=1.0, workers=32):
+        self.url = url.rstrip('/')
+        self.speed = speed
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        # Recorded task ids -> task ids returned during the replay
+        self._task_ids = {}
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = Lock()
+
+    def replay(self, records):
+        if len(records) == 0:
+            return 0.0
+
+        t0 = records[0]['time']
+        start = time.time()
+        futures = []
+        for record in records:
+            delay = start + (record['time'] - t0) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(self._pool.submit(self._send, record))
+
+        for future in futures:
+            future.result()
+        return time.time() - start
+
+    def _translate(self, record):
+        '''Path and body of a recorded request, with the task ids of the
+        replay.'''
+        path, body = record['path'], record['body']
+        if route(path) == '/<task_id>/status':
+            task_id = path.split('/')[1]
+            path = '/{}/status'.format(self._task_ids.get(task_id, task_id))
+        elif path == '/batch_status':
+            data = json.loads(body)
+            data['task_ids'] = [self._task_ids.get(t, t)
+                                for t in data['task_ids']]
+            body = json.dumps(data)
+        return path, body
+
+    def _send(self, record):
+        path, body = self._translate(record)
+
+        start = time.time()
+        try:
+            res = requests.request(record['method'], self.url + path,
+                                   data=body)
+            ok = res.status_code == 200
+        except requests.RequestException:
+            ok = False
+        latency = time.time() - start
+
+        name = route(record['path'])
+        with self._lock:
+            self.latencies[name].append(latency)
+            if not ok:
+                self.errors[name] += 1
+
+        # Map task ids of the recording to those of the replay
+        if ok and 'response' in record:
+            try:
+                old = json.loads(record['response'])['task_uuids']
+                new = res.json()['task_uuids']
+                with self._lock:
+                    self._task_ids.update(zip(old, new))
+            except (ValueError, KeyError):
+                pass
+
+    def report(self, duration):
+        all_latencies = [x for xs in self.latencies.values() for x in xs]
+        report = {
+            'requests': len(all_latencies),
+            'duration': duration,
+            'throughput': len(all_latencies) / max(duration, 1e-9),
+            'errors': sum(self.errors.values()),
+            'routes': {},
+        }
+        for name, latencies in [('all', all_latencies)] \
+                + sorted(self.latencies.items()):
+            if len(latencies) == 0:
+                continue
+            report['routes'][name] = {
+                'requests': len(latencies),
+                'p50': np.percentile(latencies, 50),
+                'p99': np.percentile(latencies, 99),
+                'errors': report['errors'] if name == 'all'
+                else self.errors[name],
+            }
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--url', type=str,
+                        default='http://localhost:5000')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Requests recorded by run_scheduler.py --record')
+    parser.add_argument('--synthetic', type=int, default=1000,
+                        help='Number of tasks, if no trace is given')
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help='Synthetic tasks submitted per second')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed-up over the recording')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--pid', type=int, default=None,
+                        help='Process id of the scheduler, to measure CPU')
+    parser.add_argument('--json', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        records = load_trace(args.trace)
+    else:
+        records = synthetic_trace(args.synthetic, args.rate)
+
+    process = None
+    if args.pid is not None:
+        if psutil is None:
+            print('Install psutil to measure the CPU usage of the scheduler')
+        else:
+            process = psutil.Process(args.pid)
+            cpu_start = sum(process.cpu_times()[:2])
+
+    generator = LoadGenerator(args.url, speed=args.speed,
+                              workers=args.workers)
+    duration = generator.replay(records)
+    report = generator.report(duration)
+    if process is not None:
+        cpu = sum(process.cpu_times()[:2]) - cpu_start
+        report['scheduler_cpu_seconds'] = cpu
+        report['scheduler_cpu_percent'] = 100.0 * cpu / max(duration, 1e-9)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['requests']} requests in {duration:.2f}s: "
+              f"{report['throughput']:.1f} requests/s, "
+              f"{report['errors']} errors")
+        if 'scheduler_cpu_percent' in report:
+            print(f"Scheduler CPU: {report['scheduler_cpu_percent']:.1f}%")
+        print('{:24} {:>10} {:>10} {:>10}'.format('route', 'requests',
+                                                  'p50 (ms)', 'p99 (ms)'))
+        for name, stats in report['routes'].items():
+            print('{:24} {:>10} {:>10.1f} {:>10.1f}'.format(
+                name, stats['requests'], 1000 * stats['p50'],
+                1000 * stats['p99']))
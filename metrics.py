@@ -0,0 +1,210 @@
+import sys
+import time
+from bisect import bisect_left
+from threading import Lock, Thread, get_ident
+from collections import defaultdict
+
+
+# Upper bounds of histogram buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0]
+
+
+def _format_labels(names, values, extra=''):
+    labels = ['{}="{}"'.format(n, str(v).replace('"', '\\"'))
+              for (n, v) in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if len(labels) > 0 else ''
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    '''A value which can go up and down. Instead of being set, it may be
+    computed when metrics are collected, by a function returning a dict
+    of label values -> value.'''
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function().items()
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = list(buckets)
+        # label values -> [count per bucket (and +Inf), sum]
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        '''Context manager observing the time spent in its block.'''
+        return _Timer(self, label_values)
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(v)) for (k, v) in self._values.items()]
+
+        for label_values, counts in values:
+            total = 0
+            bounds = [str(b) for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                total += count
+                labels = _format_labels(self.labels, label_values,
+                                        'le="{}"'.format(bound))
+                yield self.name + '_bucket' + labels, total
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_sum' + labels, counts[-1]
+            yield self.name + '_count' + labels, total
+
+
+class _Timer(object):
+
+    __slots__ = ['histogram', 'label_values', 'start']
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               *self.label_values)
+
+
+class MetricsRegistry(object):
+    '''Metrics of the scheduler, exposed in the Prometheus text format.
+
+    Recording a value only takes a lock and a few arithmetic operations;
+    all the formatting happens when metrics are collected.'''
+
+    def __init__(self, prefix='delta_'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._add(Gauge(self.prefix + name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels,
+                                   buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler(object):
+    '''Periodically samples the stacks of all threads, and counts how
+    often each stack is seen. Stacks are reported in the collapsed format
+    used by flame-graph tools: frames separated by ';', then the count.'''
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._stacks = defaultdict(int)
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._stacks.clear()
+        self._running = True
+        self._thread = Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        stacks = sorted(self._stacks.items(), key=lambda x: -x[1])
+        return ''.join('{} {}\n'.format(stack, n) for (stack, n) in stacks)
+
+    def _sample(self):
+        me = get_ident()
+        while self._running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = code.co_filename.split('/')[-1]
+                    frames.append('{}:{}'.format(name, code.co_name))
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(frames))] += 1
+            time.sleep(self.interval)
@@ -0,0 +1,39 @@
+from threading import Lock
+
+
+class PayloadStore(object):
+    '''Holds a single copy of each task's payload, keyed by the (virtual)
+    task id, which is shared by every record of that task, including its
+    backups. A payload is dropped as soon as no record references it.'''
+
+    def __init__(self):
+        self._payloads = {}
+        self._refs = {}
+        self._lock = Lock()
+        self.num_bytes = 0
+
+    def put(self, task_id, payload):
+        with self._lock:
+            self._payloads[task_id] = payload
+            self._refs[task_id] = 1
+            self.num_bytes += len(payload)
+
+    def get(self, task_id):
+        return self._payloads[task_id]
+
+    def acquire(self, task_id):
+        with self._lock:
+            self._refs[task_id] += 1
+
+    def release(self, task_id):
+        with self._lock:
+            self._refs[task_id] -= 1
+            if self._refs[task_id] == 0:
+                del self._refs[task_id]
+                self.num_bytes -= len(self._payloads.pop(task_id))
+
+    def __contains__(self, task_id):
+        return task_id in self._payloads
+
+    def __len__(self):
+        return len(self._payloads)
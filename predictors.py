@@ -1,9 +1,18 @@
+import os
 import json
+import time
 import numpy as np
 from queue import Queue
+from threading import Lock
 from collections import defaultdict
 
-from utils import avg, ENDPOINTS, MAX_CONCURRENT_TRANSFERS
+from utils import avg, write_json, ENDPOINTS
+
+
+def _copy_nested(d):
+    '''Copy of a dict of dicts of lists, e.g., to save it.'''
+    return {k: {k2: list(xs) for (k2, xs) in vs.items()}
+            for (k, vs) in d.items()}
 
 
 class RuntimePredictor(object):
@@ -15,6 +24,8 @@ class RuntimePredictor(object):
         raise NotImplementedError
 
     def update(self, task_info, new_runtime):
+        '''Learn from the runtime of a completed task, described by its
+        TaskRecord.'''
         raise NotImplementedError
 
     def has_learned(self, func, endpoint):
@@ -44,8 +55,8 @@ class RollingAverage(RuntimePredictor):
         return self.avg_runtime[func][group]
 
     def update(self, task_info, new_runtime):
-        func = task_info['function_id']
-        end = task_info['endpoint_id']
+        func = task_info.function_id
+        end = task_info.endpoint_id
         group = self.endpoints[end]['group']
 
         while len(self.runtimes[func][group].queue) > self.last_n:
@@ -80,11 +91,11 @@ class InputLength(RuntimePredictor):
         return pred.item()
 
     def update(self, task_info, new_runtime):
-        func = task_info['function_id']
-        end = task_info['endpoint_id']
+        func = task_info.function_id
+        end = task_info.endpoint_id
         group = self.endpoints[end]['group']
 
-        self.lengths[func][group].append(len(task_info['payload']))
+        self.lengths[func][group].append(task_info.payload_size)
         self.runtimes[func][group].append(new_runtime)
 
         self.updates_since_train[func][group] += 1
@@ -108,9 +119,94 @@ class InputLength(RuntimePredictor):
         return np.array([1, x, x ** 2, 2.0 * x])
 
 
+class _Length(object):
+    '''Stand-in for a payload of a given length. Payloads of completed
+    tasks are not kept, but length-based models only need their length.'''
+
+    __slots__ = ['n']
+
+    def __init__(self, n):
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+
+class Ensemble(RuntimePredictor):
+    '''Runs several models side by side, and tracks the online error of
+    each one per (func, group): every completed task is first predicted by
+    each model, then learned from. Predictions come from the model with the
+    lowest error or, if weighted, from all models weighted by the inverse of
+    their errors.'''
+
+    # Weight of the newest error in the moving average of errors
+    ERROR_DECAY = 0.2
+
+    def __init__(self, endpoints, models=None, weighted=False, *args,
+                 **kwargs):
+        super().__init__(endpoints)
+        if models is None:
+            models = [RollingAverage(endpoints, *args, **kwargs),
+                      InputLength(endpoints, *args, **kwargs)]
+        self.models = models
+        self.weighted = weighted
+        # Moving average of the absolute error of each model, or None if
+        # the model has not been scored yet
+        self.errors = defaultdict(lambda: defaultdict(
+            lambda: [None] * len(self.models)))
+
+    def predict(self, func, group, payload, *args, **kwargs):
+        errors = self.errors[func][group]
+        scored = [i for (i, e) in enumerate(errors) if e is not None]
+        if len(scored) == 0:
+            return self.models[0].predict(func, group, payload)
+
+        if not self.weighted:
+            best = min(scored, key=lambda i: errors[i])
+            return self.models[best].predict(func, group, payload)
+
+        weights = [1.0 / max(errors[i], 1e-6) for i in scored]
+        preds = [self.models[i].predict(func, group, payload) for i in scored]
+        return sum(w * p for (w, p) in zip(weights, preds)) / sum(weights)
+
+    def update(self, task_info, new_runtime):
+        func = task_info.function_id
+        end = task_info.endpoint_id
+        group = self.endpoints[end]['group']
+        payload = _Length(task_info.payload_size or 0)
+
+        errors = self.errors[func][group]
+        for i, model in enumerate(self.models):
+            # Models are only scored once they have learned something, so
+            # that their initial guesses do not count against them
+            if model.has_learned(func, end):
+                error = abs(model.predict(func, group, payload) - new_runtime)
+                if errors[i] is None:
+                    errors[i] = error
+                else:
+                    errors[i] += self.ERROR_DECAY * (error - errors[i])
+            model.update(task_info, new_runtime)
+
+    def has_learned(self, func, endpoint):
+        return any(m.has_learned(func, endpoint) for m in self.models)
+
+    def summary(self):
+        '''Error of each model, per function and group.'''
+        return {func: {group: dict(zip(map(str, self.models), errors))
+                       for (group, errors) in list(by_group.items())}
+                for (func, by_group) in list(self.errors.items())}
+
+    def __str__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join(map(str, self.models)))
+
+
 def init_runtime_predictor(predictor, *args, **kwargs):
     predictor = predictor.strip().lower()
-    if predictor.endswith('average') or predictor.endswith('avg'):
+    if 'ensemble' in predictor:
+        weighted = predictor.startswith('weighted')
+        return Ensemble(*args, weighted=weighted, **kwargs)
+    elif predictor.endswith('average') or predictor.endswith('avg'):
         return RollingAverage(*args, **kwargs)
     elif predictor.endswith('length') or predictor.endswith('size'):
         return InputLength(*args, **kwargs)
@@ -119,15 +215,31 @@ def init_runtime_predictor(predictor, *args, **kwargs):
 
 
 class TransferPredictor(object):
+    '''Predicts transfer times from their size, with a model per link
+    between transfer groups.
+
+    Transfers sharing a link also share its bandwidth, so each link's
+    capacity is learned from completed transfers, and a new transfer is
+    slowed down by the transfers already active on the same link.'''
 
-    def __init__(self, endpoints=None, train_every=1, state_file=None):
+    CAPACITY_SAMPLES = 20  # Completed transfers used to estimate capacity
+    TRANSFER_SAMPLES = 500  # Most recent transfers the size model learns from
+
+    def __init__(self, endpoints=None, train_every=1, state_file=None,
+                 transfer_manager=None):
         self.endpoints = endpoints or ENDPOINTS
+        self.transfer_manager = transfer_manager
         self.sizes = defaultdict(lambda: defaultdict(list))
         self.times = defaultdict(lambda: defaultdict(list))
         self.weights = defaultdict(lambda: defaultdict(lambda: np.zeros(3)))
+        # Observed aggregate bandwidth of each link, in bytes per second
+        self.capacity = defaultdict(lambda: defaultdict(list))
 
         self.train_every = train_every
         self.updates_since_train = defaultdict(lambda: defaultdict(int))
+        # Held while learning and while copying the state to save it.
+        # Predictions only read the state, without inserting into it.
+        self._lock = Lock()
 
         if state_file is not None:
             self._load_state_from_file(state_file)
@@ -139,14 +251,20 @@ class TransferPredictor(object):
         src_grp = self.endpoints[src]['transfer_group']
         dst_grp = self.endpoints[dst]['transfer_group']
 
-        pred = self.weights[src_grp][dst_grp].T.dot(self._preprocess(size))
-        return pred.item()
+        weights = self.weights.get(src_grp, {}).get(dst_grp)
+        if weights is None:
+            return 0.0  # Nothing learned about this link yet
+        return weights.T.dot(self._preprocess(size)).item()
 
-    def predict(self, files_by_src, dst):
+    def predict(self, files_by_src, dst, queue_wait=True):
         '''Predict the time for transfers from each source, and return
-        the maximum. Assumption: all transfers will happen concurrently.'''
+        the maximum. Assumption: all transfers will happen concurrently,
+        once they leave the transfer manager's admission queue.'''
 
-        assert(len(files_by_src) <= MAX_CONCURRENT_TRANSFERS)
+        # Files which were already staged to dst don't need to be transferred
+        if self.transfer_manager is not None:
+            files_by_src = self.transfer_manager.replicas.missing(files_by_src,
+                                                                  dst)
 
         if len(files_by_src) == 0:
             return 0.0
@@ -154,21 +272,80 @@ class TransferPredictor(object):
         times = []
         for src, pairs in files_by_src.items():
             _, sizes = zip(*pairs)
-            times.append(self.predict_one(src, dst, sum(sizes)))
+            times.append(self.predict_one(src, dst, sum(sizes))
+                         + self.contention_delay(src, dst, sum(sizes)))
+
+        # Transfers wait for a free slot if too many are already running
+        wait = 0.0
+        if queue_wait and self.transfer_manager is not None:
+            wait = self.transfer_manager.expected_wait()
+
+        return wait + max(times)
+
+    def contention_delay(self, src, dst, size):
+        '''Extra time taken to transfer size bytes because of the transfers
+        already active on the same link. Bandwidth is shared between them,
+        so each one delays the new transfer by the time needed to move the
+        bytes they have in common: min(remaining_i, size) / capacity.'''
+        if self.transfer_manager is None or src == dst:
+            return 0.0
 
-        return max(times)
+        src_grp = self.endpoints[src]['transfer_group']
+        dst_grp = self.endpoints[dst]['transfer_group']
+        capacity = self.capacity.get(src_grp, {}).get(dst_grp, [])
+        if len(capacity) == 0:
+            return 0.0  # Nothing learned about this link yet
+        capacity = avg(capacity)
+
+        now = time.time()
+        delay = 0.0
+        for info in self.transfer_manager.active_on_link(src, dst):
+            remaining = sum(info['sizes'])
+            if info['predicted_time']:
+                elapsed = now - info['submission_time']
+                remaining *= max(1.0 - elapsed / info['predicted_time'], 0.0)
+            delay += min(remaining, size) / capacity
+
+        return delay
+
+    def on_transfer_complete(self, key, info):
+        '''Learn from a transfer completed by the transfer manager.'''
+        src, dst = info['src_endpoint'], info['dst_endpoint']
+        if src == dst or info['time_taken'] <= 0:
+            return
+
+        # Average number of transfers sharing the link during this one
+        others = len(self.transfer_manager.active_on_link(src, dst))
+        load = max((info['link_load'] + others + 1) / 2.0, 1.0)
+
+        size = sum(info['sizes'])
+        src_grp = self.endpoints[src]['transfer_group']
+        dst_grp = self.endpoints[dst]['transfer_group']
+        with self._lock:
+            capacity = self.capacity[src_grp][dst_grp]
+            capacity.append(load * size / info['time_taken'])
+            del capacity[:-self.CAPACITY_SAMPLES]
+
+        # The size model predicts the time of a transfer alone on its link
+        self.update(src, dst, size, info['time_taken'] / load)
 
     def update(self, src, dst, size, transfer_time):
         src_grp = self.endpoints[src]['transfer_group']
         dst_grp = self.endpoints[dst]['transfer_group']
 
-        self.sizes[src_grp][dst_grp].append(size)
-        self.times[src_grp][dst_grp].append(transfer_time)
+        with self._lock:
+            sizes = self.sizes[src_grp][dst_grp]
+            times = self.times[src_grp][dst_grp]
+            sizes.append(size)
+            times.append(transfer_time)
+            del sizes[:-self.TRANSFER_SAMPLES]
+            del times[:-self.TRANSFER_SAMPLES]
 
-        self.updates_since_train[src_grp][dst_grp] += 1
-        if self.updates_since_train[src_grp][dst_grp] >= self.train_every:
-            self._train(src_grp, dst_grp)
-            self.updates_since_train[src_grp][dst_grp] = 0
+            self.updates_since_train[src_grp][dst_grp] += 1
+            if self.updates_since_train[src_grp][dst_grp] >= \
+                    self.train_every:
+                self._train(src_grp, dst_grp)
+                self.updates_since_train[src_grp][dst_grp] = 0
 
     def _train(self, src_grp, dst_grp):
         sizes = np.array([self._preprocess(x)
@@ -182,19 +359,21 @@ class TransferPredictor(object):
         return np.array([1, x, np.log(x)])
 
     def to_file(self, file_name):
-        sizes = {k: dict(vs) for (k, vs) in self.sizes.items()}
-        times = {k: dict(vs) for (k, vs) in self.times.items()}
-        weights = {s: {d: w.tolist() for (d, w) in vs.items()}
-                   for (s, vs) in self.weights.items()}
+        with self._lock:
+            sizes = _copy_nested(self.sizes)
+            times = _copy_nested(self.times)
+            weights = {s: {d: w.tolist() for (d, w) in vs.items()}
+                       for (s, vs) in self.weights.items()}
+            capacity = _copy_nested(self.capacity)
 
         state = {
             'sizes': sizes,
             'times': times,
             'weights': weights,
+            'capacity': capacity,
         }
 
-        with open(file_name, 'w') as fh:
-            json.dump(state, fh)
+        write_json(file_name, state)
 
     def _load_state_from_file(self, file_name):
         with open(file_name) as fh:
@@ -202,16 +381,20 @@ class TransferPredictor(object):
 
         for s, vs in state['sizes'].items():
             for d, xs in vs.items():
-                self.sizes[s][d] = xs
+                self.sizes[s][d] = xs[-self.TRANSFER_SAMPLES:]
 
         for s, vs in state['times'].items():
             for d, xs in vs.items():
-                self.times[s][d] = xs
+                self.times[s][d] = xs[-self.TRANSFER_SAMPLES:]
 
         for s, vs in state['weights'].items():
             for d, xs in vs.items():
                 self.weights[s][d] = np.array(xs)
 
+        for s, vs in state.get('capacity', {}).items():
+            for d, xs in vs.items():
+                self.capacity[s][d] = xs
+
         return self
 
     def __call__(self, *args, **kwargs):
@@ -222,35 +405,111 @@ class TransferPredictor(object):
 
 
 class ImportPredictor(object):
+    '''Time to import each package, per group of endpoints. Times start
+    from the model file, and are replaced by the median of the most recent
+    import times reported by workers, once there are some.'''
+
+    IMPORT_SAMPLES = 20
 
     def __init__(self, endpoints=None, state_file=None):
         self.endpoints = endpoints or ENDPOINTS
         self.import_times = defaultdict(lambda: defaultdict(float))
+        self.samples = defaultdict(lambda: defaultdict(list))
+        self._lock = Lock()
 
         if state_file is not None:
             self._load_state_from_file(state_file)
 
     def record(self, pkg, endpoint, import_time):
         group = self.endpoints[endpoint]['group']
-        self.import_times[pkg][group] = import_time
+        with self._lock:
+            samples = self.samples[pkg][group]
+            samples.append(import_time)
+            del samples[:-self.IMPORT_SAMPLES]
+            self.import_times[pkg][group] = float(np.median(samples))
 
     def predict(self, pkg, endpoint):
         group = self.endpoints[endpoint]['group']
-        return self.import_times[pkg][group]
+        return self.import_times.get(pkg, {}).get(group, 0.0)
 
     def __call__(self, *args, **kwargs):
         return self.predict(*args, **kwargs)
 
     def to_file(self, file_name):
-        times = {pkg: dict(vs) for (pkg, vs) in self.import_times.items()}
+        with self._lock:
+            times = {pkg: dict(vs) for (pkg, vs) in self.import_times.items()}
+            samples = _copy_nested(self.samples)
 
-        with open(file_name, 'w') as fh:
-            json.dump({'import_times': times}, fh)
+        write_json(file_name, {'import_times': times, 'samples': samples})
 
     def _load_state_from_file(self, file_name):
         with open(file_name) as fh:
             data = json.load(fh)
 
-        for pkg, values in data.items():
+        for pkg, values in data['import_times'].items():
             for group, import_time in values.items():
                 self.import_times[pkg][group] = import_time
+
+        for pkg, values in data.get('samples', {}).items():
+            for group, samples in values.items():
+                self.samples[pkg][group] = samples[-self.IMPORT_SAMPLES:]
+
+
+class ColdStartPredictor(object):
+    '''Launch times of endpoints, learned from how long they take to warm
+    up after a task is sent to them while cold. On HPC endpoints, this
+    includes the time spent waiting in the batch scheduler's queue, so it
+    is kept per endpoint rather than per group.'''
+
+    LAUNCH_SAMPLES = 20
+
+    def __init__(self, endpoints=None, quantile=0.5, state_file=None):
+        self.endpoints = endpoints or ENDPOINTS
+        self.quantile = quantile
+        self.launch_times = defaultdict(list)
+        self._lock = Lock()
+
+        if state_file is not None and os.path.exists(state_file):
+            self._load_state_from_file(state_file)
+
+    def record(self, endpoint, launch_time):
+        with self._lock:
+            samples = self.launch_times[endpoint]
+            samples.append(launch_time)
+            del samples[:-self.LAUNCH_SAMPLES]
+
+    def has_learned(self, endpoint):
+        return len(self.launch_times.get(endpoint, [])) > 0
+
+    def predict(self, endpoint):
+        '''Launch time of an endpoint: a quantile of its recent launch
+        times, or the launch time in its config until one is observed.'''
+        samples = self.launch_times.get(endpoint, [])
+        if len(samples) == 0:
+            return self.endpoints[endpoint].get('launch_time', 0.0)
+        return float(np.percentile(samples, 100 * self.quantile))
+
+    def summary(self):
+        with self._lock:
+            launch_times = {e: list(xs)
+                            for (e, xs) in self.launch_times.items()
+                            if len(xs) > 0}
+        return {end: {'samples': len(xs), 'median': float(np.median(xs)),
+                      'p90': float(np.percentile(xs, 90)), 'max': max(xs)}
+                for (end, xs) in launch_times.items()}
+
+    def __call__(self, *args, **kwargs):
+        return self.predict(*args, **kwargs)
+
+    def to_file(self, file_name):
+        with self._lock:
+            launch_times = {e: list(xs)
+                            for (e, xs) in self.launch_times.items()}
+        write_json(file_name, {'launch_times': launch_times})
+
+    def _load_state_from_file(self, file_name):
+        with open(file_name) as fh:
+            data = json.load(fh)
+
+        for end, samples in data['launch_times'].items():
+            self.launch_times[end] = samples[-self.LAUNCH_SAMPLES:]
@@ -0,0 +1,147 @@
+import time
+import logging
+from threading import Lock, Thread
+from collections import defaultdict, deque, Counter
+
+from utils import colored, endpoint_name
+
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter(
+    colored("[PREFETCH]  %(message)s", 'cyan')))
+logger.addHandler(ch)
+
+
+HISTORY = 50  # Recent placements and file uses remembered per function
+MIN_SHARE = 0.25  # Share of recent placements to prefetch to an endpoint
+MIN_USES = 2  # Recent uses of a file before it is worth prefetching
+PREFETCH_INTERVAL = 5.0  # Seconds between prefetching rounds
+
+
+class Prefetcher(object):
+    '''Stages the input files of upcoming tasks before they are scheduled.
+
+    For each function, remembers where its recent tasks were placed and
+    which files they used. Every few seconds, files used repeatedly by a
+    function are transferred to the endpoints its tasks usually run on
+    (unless the strategy considers them dead), at the lowest transfer
+    priority and within a bandwidth budget, in bytes per second.
+
+    A prefetched file is a hit if a task scheduled to that endpoint uses
+    it, and wasted if it is evicted from the endpoint before that.'''
+
+    def __init__(self, transfer_manager, strategy, budget=1e7,
+                 log_level='INFO'):
+        self.transfer_manager = transfer_manager
+        self.strategy = strategy
+        self.budget = budget
+        logger.setLevel(log_level)
+
+        self._placements = defaultdict(lambda: deque(maxlen=HISTORY))
+        self._uses = defaultdict(lambda: deque(maxlen=HISTORY))
+        # (endpoint, path) -> size of prefetched files not yet used
+        self._prefetched = {}
+        self.stats = defaultdict(float)
+        self._lock = Lock()
+
+        transfer_manager.replicas.add_evict_callback(self._on_evict)
+
+        self._thread = Thread(target=self._prefetch_periodically)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, func, endpoint, files_by_src):
+        '''Record that a task of func, using these files, was scheduled to
+        endpoint. Must be called before its files are transferred.'''
+        missing = self.transfer_manager.replicas.missing(files_by_src,
+                                                         endpoint)
+        missing = {(src, f) for (src, pairs) in missing.items()
+                   for (f, _) in pairs}
+
+        with self._lock:
+            self._placements[func].append(endpoint)
+            for src, pairs in files_by_src.items():
+                for f, size in pairs:
+                    self._uses[func].append((src, f, size))
+
+                    if self._prefetched.pop((endpoint, f), None) is not None:
+                        self.stats['hits'] += 1
+                        self.stats['hit_bytes'] += size
+                    elif (src, f) in missing and src != endpoint:
+                        self.stats['misses'] += 1
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            needed = stats.get('hits', 0) + stats.get('misses', 0)
+            stats['hit_rate'] = stats.get('hits', 0) / max(needed, 1)
+            stats['unused_bytes'] = sum(self._prefetched.values())
+        return stats
+
+    def _on_evict(self, endpoint, pairs):
+        with self._lock:
+            for f, size in pairs:
+                if self._prefetched.pop((endpoint, f), None) is not None:
+                    self.stats['wasted_files'] += 1
+                    self.stats['wasted_bytes'] += size
+
+    def _candidates(self):
+        '''Files worth staging to each endpoint, most used first.'''
+        candidates = defaultdict(Counter)  # endpoint -> (src, f, size) -> n
+        with self._lock:
+            for func, placements in self._placements.items():
+                counts = Counter(placements)
+                endpoints = [e for (e, n) in counts.items()
+                             if n >= MIN_SHARE * len(placements)
+                             and e not in self.strategy.dead_endpoints]
+                uses = Counter(self._uses[func])
+                for endpoint in endpoints:
+                    for (src, f, size), n in uses.items():
+                        if n >= MIN_USES and src != endpoint \
+                                and (endpoint, f) not in self._prefetched:
+                            candidates[endpoint][(src, f, size)] += n
+
+        return candidates
+
+    def _prefetch(self, allowance):
+        '''Start prefetching transfers, moving at most allowance bytes.'''
+        replicas = self.transfer_manager.replicas
+        for endpoint, counts in self._candidates().items():
+            files_by_src = defaultdict(list)
+            for (src, f, size), _ in counts.most_common():
+                if size > allowance:
+                    continue
+                if replicas.has(f, endpoint):
+                    continue
+                files_by_src[src].append((f, size))
+                allowance -= size
+
+            if len(files_by_src) == 0:
+                continue
+
+            with self._lock:
+                for src, pairs in files_by_src.items():
+                    for f, size in pairs:
+                        self._prefetched[(endpoint, f)] = size
+                        self.stats['prefetched_files'] += 1
+                        self.stats['prefetched_bytes'] += size
+
+            logger.info('Prefetching {} files to {}'.format(
+                sum(len(x) for x in files_by_src.values()),
+                endpoint_name(endpoint)))
+            num = self.transfer_manager.transfer(
+                dict(files_by_src), endpoint, task_id='prefetch',
+                priority=float('inf'))
+            if num is not None:
+                self.transfer_manager.release(num)
+
+    def _prefetch_periodically(self):
+        logger.info('Starting prefetching thread')
+
+        while True:
+            time.sleep(PREFETCH_INTERVAL)
+            try:
+                self._prefetch(self.budget * PREFETCH_INTERVAL)
+            except Exception as e:
+                logger.error('Prefetching failed: {}'.format(e))
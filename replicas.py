@@ -0,0 +1,107 @@
+from threading import RLock
+from collections import defaultdict, OrderedDict
+
+
+class ReplicaCatalog(object):
+    '''Files which have been staged to endpoints by successful transfers.
+
+    Each endpoint may have a storage quota (the 'storage_quota' key of its
+    config, or a default for all endpoints), in bytes. When staging a file
+    exceeds it, the least-recently used files are evicted, unless they are
+    pinned by tasks which still need them.'''
+
+    def __init__(self, endpoints, default_quota=None, on_evict=None):
+        self.quotas = {e: info.get('storage_quota', default_quota)
+                       for (e, info) in endpoints.items()}
+        # Called with (endpoint, [(path, size)]) whenever files are evicted
+        self._evict_callbacks = [on_evict] if on_evict is not None else []
+
+        self._replicas = defaultdict(OrderedDict)  # endpoint -> path -> size
+        self._locations = defaultdict(set)  # path -> endpoints
+        self._pins = defaultdict(int)  # (endpoint, path) -> count
+        self.used = defaultdict(int)
+        self._lock = RLock()
+
+    def has(self, path, endpoint):
+        return path in self._replicas[endpoint]
+
+    def locations(self, path):
+        return set(self._locations[path])
+
+    def missing(self, files_by_src, dst, touch=False):
+        '''Files which do not have a replica on endpoint dst yet.'''
+        with self._lock:
+            missing = {}
+            for src, pairs in files_by_src.items():
+                pairs = [(f, size) for (f, size) in pairs
+                         if not self._use(f, dst, touch)]
+                if len(pairs) > 0:
+                    missing[src] = pairs
+            return missing
+
+    def add(self, endpoint, pairs):
+        with self._lock:
+            for path, size in pairs:
+                if path in self._replicas[endpoint]:
+                    self.used[endpoint] -= self._replicas[endpoint][path]
+                self._replicas[endpoint][path] = size
+                self._replicas[endpoint].move_to_end(path)
+                self._locations[path].add(endpoint)
+                self.used[endpoint] += size
+
+            evicted = self._evict(endpoint)
+
+        if len(evicted) > 0:
+            for callback in self._evict_callbacks:
+                callback(endpoint, evicted)
+
+    def add_evict_callback(self, callback):
+        self._evict_callbacks.append(callback)
+
+    def remove(self, endpoint, path):
+        with self._lock:
+            if path in self._replicas[endpoint]:
+                self.used[endpoint] -= self._replicas[endpoint].pop(path)
+                self._locations[path].discard(endpoint)
+                if len(self._locations[path]) == 0:
+                    del self._locations[path]
+
+    def pin(self, endpoint, files_by_src):
+        with self._lock:
+            for pairs in files_by_src.values():
+                for path, _ in pairs:
+                    self._pins[(endpoint, path)] += 1
+
+    def unpin(self, endpoint, files_by_src):
+        with self._lock:
+            for pairs in files_by_src.values():
+                for path, _ in pairs:
+                    self._pins[(endpoint, path)] -= 1
+                    if self._pins[(endpoint, path)] <= 0:
+                        del self._pins[(endpoint, path)]
+
+    def _use(self, path, endpoint, touch):
+        if path not in self._replicas[endpoint]:
+            return False
+        if touch:
+            self._replicas[endpoint].move_to_end(path)
+        return True
+
+    def _evict(self, endpoint):
+        quota = self.quotas.get(endpoint)
+        if quota is None:
+            return []
+
+        evicted = []
+        for path, size in list(self._replicas[endpoint].items()):
+            if self.used[endpoint] <= quota:
+                break
+            if (endpoint, path) in self._pins:
+                continue
+            self.remove(endpoint, path)
+            evicted.append((path, size))
+
+        return evicted
+
+    def __len__(self):
+        return sum(len(x) for x in self._replicas.values())
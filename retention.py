@@ -0,0 +1,31 @@
+import time
+from threading import Lock
+from collections import deque
+
+
+class Retention(object):
+    '''Keys which should be forgotten some fixed time after they are added.
+
+    Since every key is kept for the same amount of time, keys expire in the
+    order they were added, so finding expired keys never requires looking
+    past the first one which has not expired yet.'''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._expiries = deque()
+        self._lock = Lock()
+
+    def add(self, key, now=None):
+        with self._lock:
+            self._expiries.append(((now or time.time()) + self.ttl, key))
+
+    def expired(self, now=None):
+        now = now or time.time()
+        keys = []
+        with self._lock:
+            while len(self._expiries) > 0 and self._expiries[0][0] <= now:
+                keys.append(self._expiries.popleft()[1])
+        return keys
+
+    def __len__(self):
+        return len(self._expiries)
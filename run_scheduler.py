@@ -1,9 +1,10 @@
 import yaml
 import json
+import time
 import logging
 import argparse
 import requests
-from flask import Flask, request
+from flask import Flask, Response, request
 
 try:
     from termcolor import colored
@@ -11,7 +12,7 @@ except ImportError:
     def colored(x, *args, **kwargs):
         return x
 
-from central_scheduler import CentralScheduler, FUNCX_API
+from central_scheduler import CentralScheduler
 
 funcx_app = Flask(__name__)
 ch = logging.StreamHandler()
@@ -20,9 +21,12 @@ funcx_app.logger.addHandler(ch)
 funcx_app.logger.setLevel('DEBUG')
 logging.getLogger('werkzeug').setLevel('ERROR')
 
+# Client requests are appended to this file, if any, to be replayed later
+RECORD_FILE = None
+
 
 def forward_request(request, route=None, headers=None, data=None):
-    url = f'{FUNCX_API}{route or request.path}'
+    url = f'{SCHEDULER.funcx_api}{route or request.path}'
     headers = headers or request.headers
     data = data or request.data
 
@@ -30,6 +34,23 @@ def forward_request(request, route=None, headers=None, data=None):
                             data=data)
 
 
+@funcx_app.after_request
+def record_request(response):
+    if RECORD_FILE is not None:
+        record = {
+            'time': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'body': request.get_data(as_text=True),
+        }
+        # Task ids are needed to replay later requests about the tasks
+        if request.path == '/submit':
+            record['response'] = response.get_data(as_text=True)
+        RECORD_FILE.write(json.dumps(record) + '\n')
+        RECORD_FILE.flush()
+    return response
+
+
 @funcx_app.route('/', methods=['GET'])
 def base():
     return 'OK'
@@ -95,7 +116,10 @@ def batch_submit():
             'reason': 'Endpoints should be \'UNDECIDED\''
         })
 
-    tasks = [(func, payload) for (func, _, payload) in data['tasks']]
+    # Tasks may carry their required files as an optional fourth element,
+    # so that the scheduler does not need to deserialize their arguments
+    tasks = [(t[0], t[2], t[3] if len(t) > 3 else None)
+             for t in data['tasks']]
     task_uuids, endpoints = SCHEDULER.batch_submit(tasks, headers)
     return json.dumps({
         'status': 'Success',
@@ -109,11 +133,66 @@ def block(func, endpoint):
     return SCHEDULER.block(func, endpoint)
 
 
+@funcx_app.route('/cache/<func>', methods=['GET'])
+def cache(func):
+    return SCHEDULER.enable_caching(func)
+
+
+@funcx_app.route('/memory_footprint', methods=['GET'])
+def memory_footprint():
+    return SCHEDULER.memory_footprint()
+
+
+@funcx_app.route('/health', methods=['GET'])
+def health():
+    return SCHEDULER.endpoint_health()
+
+
+@funcx_app.route('/hedging_stats', methods=['GET'])
+def hedging_stats():
+    return dict(SCHEDULER.hedging_stats)
+
+
+@funcx_app.route('/prefetch_stats', methods=['GET'])
+def prefetch_stats():
+    return SCHEDULER.prefetch_stats()
+
+
+@funcx_app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(SCHEDULER.metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@funcx_app.route('/profiler/start', methods=['GET'])
+def start_profiler():
+    SCHEDULER.profiler.start()
+    return 'Profiler started\n'
+
+
+@funcx_app.route('/profiler/stop', methods=['GET'])
+def stop_profiler():
+    # Returns the sampled stacks, in the collapsed format of flame graphs
+    SCHEDULER.profiler.stop()
+    return Response(SCHEDULER.profiler.report(), mimetype='text/plain')
+
+
 @funcx_app.route('/execution_log', methods=['GET'])
 def execution_log():
-    log = SCHEDULER.execution_log
-    SCHEDULER.execution_log = []
-    return {'log': log}
+    # Clients pass the cursor returned by their previous call as `since`
+    since = request.args.get('since', 0, type=int)
+
+    try:
+        if request.args.get('stream', 'false').lower() in ['true', '1']:
+            lines, cursor = SCHEDULER.execution_log.stream(since)
+            return Response(lines, mimetype='application/x-ndjson',
+                            headers={'X-Next-Cursor': str(cursor)})
+
+        limit = request.args.get('limit', 1000, type=int)
+        log, cursor = SCHEDULER.execution_log.read(since, limit)
+        return {'log': log, 'next': cursor}
+    except ValueError as e:  # Invalid cursor
+        return Response(str(e), status=400, mimetype='text/plain')
 
 
 if __name__ == "__main__":
@@ -128,17 +207,59 @@ if __name__ == "__main__":
     parser.add_argument('--train-every', type=int, default=1)
     parser.add_argument('-b', '--max-backups', type=int, default=0)
     parser.add_argument('--backup-delay', type=float, default=2.0)
+    parser.add_argument('--ignore-late-results', action='store_true',
+                        default=False)
+    parser.add_argument('--late-binding', action='store_true', default=False)
+    parser.add_argument('--rebind-margin', type=float, default=1.0)
     parser.add_argument('--sync-level', type=str, default='exists')
+    parser.add_argument('--transfer-window', type=float, default=0.5)
+    parser.add_argument('--storage-quota', type=int, default=None)
+    parser.add_argument('--delete-evicted', action='store_true',
+                        default=False,
+                        help='Delete files evicted by --storage-quota from '
+                        'endpoints, if they are in --staging-dir')
+    parser.add_argument('--staging-dir', type=str, default=None)
+    parser.add_argument('--prefetch', action='store_true', default=False)
+    parser.add_argument('--prefetch-budget', type=float, default=1e7)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--cache-ttl', type=float, default=3600.0)
+    parser.add_argument('--cache-max-bytes', type=int, default=2 ** 28)
+    parser.add_argument('--deserialize-workers', type=int, default=0)
+    parser.add_argument('--retention-ttl', type=float, default=3600.0)
+    parser.add_argument('--execution-log', type=str,
+                        default='execution_log.jsonl')
     parser.add_argument('--transfer-model', type=str,
                         default='transfer_model.json')
     parser.add_argument('--import-model', type=str,
                         default='import_model.json')
+    parser.add_argument('--model-dir', type=str, default='learned_models',
+                        help='Directory where learned models are saved, and '
+                        'loaded from instead of the hand-made models')
+    parser.add_argument('--fake', type=str, default=None,
+                        help='URL of a fake funcX service (fake_funcx.py) '
+                        'to use instead of funcX and Globus')
+    parser.add_argument('--record', type=str, default=None,
+                        help='File to record client requests to')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='Sample stacks from the start (see /profiler)')
     parser.add_argument('--log-level', type=str, default='INFO')
     args = parser.parse_args()
 
     with open(args.endpoints) as fh:
         endpoints = yaml.safe_load(fh)
 
+    clients = {}
+    if args.fake is not None:
+        from fake_funcx import FakeFuncXClient, FakeTransferClient
+        clients = {
+            'funcx_api': args.fake,
+            'funcx_client': FakeFuncXClient(args.fake),
+            'transfer_client': FakeTransferClient(),
+        }
+
+    if args.record is not None:
+        RECORD_FILE = open(args.record, 'a')
+
     global SCHEDULER
     SCHEDULER = CentralScheduler(endpoints=endpoints,
                                  strategy=args.strategy,
@@ -147,10 +268,30 @@ if __name__ == "__main__":
                                  train_every=args.train_every,
                                  max_backups=args.max_backups,
                                  backup_delay_threshold=args.backup_delay,
+                                 ignore_late_results=args.ignore_late_results,
+                                 late_binding=args.late_binding,
+                                 rebind_margin=args.rebind_margin,
                                  sync_level=args.sync_level,
+                                 transfer_window=args.transfer_window,
+                                 storage_quota=args.storage_quota,
+                                 delete_evicted=args.delete_evicted,
+                                 staging_dir=args.staging_dir,
+                                 prefetch=args.prefetch,
+                                 prefetch_budget=args.prefetch_budget,
+                                 cache_size=args.cache_size,
+                                 cache_ttl=args.cache_ttl,
+                                 cache_max_bytes=args.cache_max_bytes,
+                                 deserialize_workers=args.deserialize_workers,
+                                 retention_ttl=args.retention_ttl,
+                                 execution_log_file=args.execution_log,
                                  transfer_model_file=args.transfer_model,
                                  import_model_file=args.import_model,
-                                 log_level=args.log_level)
+                                 model_dir=args.model_dir,
+                                 log_level=args.log_level,
+                                 **clients)
+
+    if args.profile:
+        SCHEDULER.profiler.start()
 
     funcx_app.run(host='0.0.0.0', port=args.port, debug=args.debug,
                   threaded=False,
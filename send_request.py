@@ -65,6 +65,21 @@ def import_module(module):
     exec('import ' + module)
 
 
+def batch_run(client, tasks):
+    '''Submit (function_id, args, files) tasks to the scheduler. Files map
+    source endpoints to lists of (path, size), and are sent alongside the
+    payload, so that the scheduler does not deserialize the arguments.'''
+    serializer = client.fx_serializer
+    data = {'tasks': []}
+    for function_id, args, files in tasks:
+        payload = serializer.pack_buffers([serializer.serialize(args),
+                                           serializer.serialize({})])
+        data['tasks'].append([function_id, 'UNDECIDED', payload, files])
+
+    res = client.post('submit', json_body=data)
+    return res['task_uuids']
+
+
 if __name__ == "__main__":
     client = FuncXSmartClient(funcx_service_address='http://localhost:5000',
                               force_login=False, log_level='INFO',
@@ -86,13 +101,12 @@ if __name__ == "__main__":
     csil4 = '576ab4d8-64b9-44cd-9c77-f2e8ea7877ae'
     aws1 = '7ff9c62e-9cc7-4b30-ba63-56229e490f48'
     # client.block(func, aws1)
-    warmup_batch = client.create_batch()
+    warmup_batch = []
     for _ in range(NUM_GROUPS):
         for x in INPUTS:
-            task = warmup_batch.add('tensorflow', function_id=func)
-            # task = warmup_batch.add(x, function_id=func,
-            # files=[(aws1, x, 10)])
-    task_ids = client.batch_run(warmup_batch)
+            warmup_batch.append((func, ('tensorflow',), {}))
+            # warmup_batch.append((func, (x,), {aws1: [(x, 10)]}))
+    task_ids = batch_run(client, warmup_batch)
     for task_id in task_ids:
         try:
             res = client.get_result(task_id, block=True)
@@ -105,7 +119,7 @@ if __name__ == "__main__":
     overall_start = time.time()
     for i in range(NUM_TASKS):
         start = time.time()
-        task = client.run(INPUTS[i % len(INPUTS)], function_id=func)
+        task, = batch_run(client, [(func, (INPUTS[i % len(INPUTS)],), {})])
         print('Time to schedule: {:.3f} s'.format(time.time() - start))
         tasks.append(task)
 
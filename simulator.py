@@ -0,0 +1,432 @@
+'''Discrete-event simulation of scheduling strategies.
+
+Replays a workload against simulated endpoints, in simulated time, using
+the real strategy and predictor classes. Endpoints are read from
+endpoints.yaml, where each one may also set 'workers' and 'launch_time'.
+
+Run from the repository root:
+    python simulator.py -s smallest-eta --trace execution_log.jsonl
+    python simulator.py -s round-robin --synthetic 10000 --rate 100
+'''
+
+import json
+import time
+import heapq
+import random
+import argparse
+from collections import defaultdict, deque
+
+import yaml
+import numpy as np
+
+from tasks import TaskRecord
+from strategies import init_strategy, FUNCX_LATENCY
+from predictors import init_runtime_predictor, TransferPredictor
+
+
+HEARTBEAT_THRESHOLD = 75.0  # Same as the scheduler's
+DEFAULT_WORKERS = 4
+DEFAULT_BANDWIDTH = 1e8  # Bytes per second between transfer groups
+DEFAULT_LINK_LATENCY = 1.0  # Seconds to start a transfer
+
+
+class Payload(object):
+    '''Stand-in for a serialized payload. Predictors only use its length.'''
+
+    __slots__ = ['size']
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+class SimEndpoint(object):
+
+    def __init__(self, info, speed=1.0, workers=DEFAULT_WORKERS):
+        self.name = info.get('name', '')
+        self.workers = info.get('workers', workers)
+        self.speed = speed
+        self.launch_time = info.get('launch_time', 0.0)
+        self.temperature = 'COLD' if self.launch_time > 0 else 'WARM'
+        self.up = True
+        self.failed_at = None
+
+        self.queue = deque()  # (task record, runtime on a speed-1 endpoint)
+        self.busy = 0
+        self.busy_time = 0.0
+        self.num_tasks = 0
+
+
+class Simulator(object):
+    '''Simulates the scheduler, funcX endpoints and Globus links.
+
+    Tasks are scheduled as by the central scheduler: the strategy picks
+    an endpoint, missing files are transferred, and the task is sent once
+    they arrive. Each endpoint runs as many tasks at once as it has
+    workers, first come first served, and tasks run 'speed' times faster
+    than their base runtime. Cold endpoints take 'launch_time' to start.
+
+    Transfers between transfer groups take the link's latency plus their
+    size divided by its bandwidth, without contention between transfers.
+    Endpoints may fail for a while: they stop starting tasks, and are
+    declared dead once their heartbeats are older than the threshold.'''
+
+    def __init__(self, endpoints, strategy='round-robin',
+                 runtime_predictor='rolling-average', last_n=3,
+                 train_every=1, speeds=None, workers=DEFAULT_WORKERS,
+                 bandwidth=DEFAULT_BANDWIDTH, bandwidths=None,
+                 link_latency=DEFAULT_LINK_LATENCY, failures=()):
+        self.endpoints = endpoints
+        speeds = speeds or {}
+        self.sim = {e: SimEndpoint(info, speeds.get(info['group'], 1.0),
+                                   workers)
+                    for (e, info) in endpoints.items()}
+        self.bandwidth = bandwidth
+        self.bandwidths = bandwidths or {}  # (src group, dst group) -> B/s
+        self.link_latency = link_latency
+
+        self.now = 0.0
+        self._events = []  # Min-heap of (time, seq, handler, args)
+        self._seq = 0
+
+        self.runtime = init_runtime_predictor(runtime_predictor,
+                                              endpoints=endpoints,
+                                              last_n=last_n,
+                                              train_every=train_every)
+        self.transfer_time = TransferPredictor(endpoints=endpoints,
+                                               train_every=train_every)
+        self.strategy = init_strategy(strategy, endpoints=endpoints,
+                                      runtime_predictor=self.runtime,
+                                      queue_predictor=self.queue_delay,
+                                      cold_start_predictor=self.cold_start,
+                                      transfer_predictor=self.transfer_time,
+                                      clock=self.clock)
+
+        self._last_task_ETA = defaultdict(float)
+        self._queue_error = defaultdict(float)
+        self._num_pending = defaultdict(int)
+        self._transfer_ETAs = defaultdict(dict)
+        self._num_transfers = 0
+        self._replicas = defaultdict(set)  # endpoint -> staged paths
+
+        self.latencies = []
+        self.first_arrival = None
+        self.last_completion = 0.0
+
+        for endpoint, start, duration in failures:
+            self._schedule(start, self._fail, endpoint)
+            self._schedule(start + duration, self._recover, endpoint)
+
+    def clock(self):
+        return self.now
+
+    def queue_delay(self, endpoint):
+        delay = self._last_task_ETA[endpoint] + self._queue_error[endpoint]
+        return max(delay, self.now)
+
+    def cold_start(self, endpoint, func):
+        sim = self.sim[endpoint]
+        return sim.launch_time if sim.temperature == 'COLD' else 0.0
+
+    def run(self, tasks):
+        '''Simulate tasks, an iterable of dicts with a submission 'time',
+        a 'function', its 'runtime' on a speed-1 endpoint, and optionally
+        a 'payload_size' and 'files', sorted by time.'''
+        self._tasks = iter(tasks)
+        self._next_arrival()
+
+        while len(self._events) > 0:
+            self.now, _, handler, args = heapq.heappop(self._events)
+            handler(*args)
+
+        return self.report()
+
+    def report(self):
+        latencies = np.array(self.latencies or [0.0])
+        makespan = self.last_completion - (self.first_arrival or 0.0)
+        return {
+            'tasks': len(self.latencies),
+            'makespan': makespan,
+            'latency': {
+                'mean': latencies.mean(),
+                'p50': np.percentile(latencies, 50),
+                'p90': np.percentile(latencies, 90),
+                'p99': np.percentile(latencies, 99),
+                'max': latencies.max(),
+            },
+            'utilization': {
+                sim.name: sim.busy_time / (sim.workers * max(makespan, 1e-9))
+                for sim in self.sim.values()
+            },
+            'tasks_per_endpoint': {sim.name: sim.num_tasks
+                                   for sim in self.sim.values()},
+        }
+
+    def _schedule(self, t, handler, *args):
+        self._seq += 1
+        heapq.heappush(self._events, (t, self._seq, handler, args))
+
+    def _next_arrival(self):
+        task = next(self._tasks, None)
+        if task is not None:
+            self._schedule(task['time'], self._arrive, task)
+
+    def _arrive(self, task):
+        self._next_arrival()
+        if self.first_arrival is None:
+            self.first_arrival = self.now
+
+        func = task['function']
+        files = task.get('files') or {}
+        payload = Payload(task.get('payload_size', 0))
+        info = TaskRecord(function_id=func, payload_size=len(payload),
+                          headers=None, files=files, time_requested=self.now)
+
+        # Files can only be staged to endpoints with Globus
+        exclude = set()
+        if len(files) > 0:
+            exclude = {e for (e, x) in self.endpoints.items()
+                       if 'transfer_group' not in x}
+        choice = self.strategy.choose_endpoint(
+            func, payload=payload, files=files, exclude=exclude,
+            transfer_ETAs=self._transfer_ETAs)
+        endpoint = info.endpoint_id = choice['endpoint']
+        ETA = self.strategy.predict_ETA(func, endpoint, payload, files=files)
+
+        sim = self.sim[endpoint]
+        if sim.temperature == 'COLD':
+            sim.temperature = 'WARMING'
+            self._schedule(self.now + sim.launch_time, self._warm, endpoint)
+
+        transfers = []
+        for src, pairs in files.items():
+            pairs = [(f, size) for (f, size) in pairs
+                     if f not in self._replicas[endpoint]]
+            if src != endpoint and len(pairs) > 0:
+                transfers.append((src, pairs, self._link_time(
+                    src, endpoint, sum(size for (_, size) in pairs))))
+
+        if len(transfers) == 0:
+            self._last_task_ETA[endpoint] = ETA
+            self._send(info, payload, task['runtime'])
+            return
+
+        self._num_transfers += 1
+        num = self._num_transfers
+        predicted = self.transfer_time(files, endpoint)
+        self._transfer_ETAs[endpoint][num] = self.now + predicted
+        done = self.now + max(t for (_, _, t) in transfers)
+        self._schedule(done, self._transfer_done, info, payload,
+                       task['runtime'], num, transfers)
+
+    def _link_time(self, src, dst, size):
+        link = (self.endpoints[src]['transfer_group'],
+                self.endpoints[dst]['transfer_group'])
+        return self.link_latency \
+            + size / self.bandwidths.get(link, self.bandwidth)
+
+    def _transfer_done(self, info, payload, runtime, num, transfers):
+        endpoint = info.endpoint_id
+        for src, pairs, transfer_time in transfers:
+            size = sum(size for (_, size) in pairs)
+            self.transfer_time.update(src, endpoint, size, transfer_time)
+            self._replicas[endpoint].update(f for (f, _) in pairs)
+
+        del self._transfer_ETAs[endpoint][num]
+        info.transfer_time = self.now - info.time_requested
+        self._send(info, payload, runtime)
+
+    def _send(self, info, payload, runtime):
+        endpoint = info.endpoint_id
+        info.ETA = self.strategy.predict_ETA(info.function_id, endpoint,
+                                             payload)
+        info.time_sent = self.now
+        self._last_task_ETA[endpoint] = info.ETA
+        self._num_pending[endpoint] += 1
+
+        self.sim[endpoint].queue.append((info, runtime))
+        self._schedule(self.now + FUNCX_LATENCY, self._start_tasks, endpoint)
+
+    def _start_tasks(self, endpoint):
+        sim = self.sim[endpoint]
+        while sim.up and sim.temperature == 'WARM' \
+                and sim.busy < sim.workers and len(sim.queue) > 0:
+            info, runtime = sim.queue.popleft()
+            duration = runtime / sim.speed
+            sim.busy += 1
+            sim.busy_time += duration
+            self._schedule(self.now + duration, self._finish, info, duration)
+
+    def _finish(self, info, duration):
+        endpoint = info.endpoint_id
+        sim = self.sim[endpoint]
+        sim.busy -= 1
+        sim.num_tasks += 1
+
+        info.runtime = duration
+        info.ATA = self.now
+        self.runtime.update(info, duration)
+
+        # As in the scheduler, the last task's error offsets later ETAs
+        if self._num_pending[endpoint] == 1:
+            self._last_task_ETA[endpoint] = 0.0
+            self._queue_error[endpoint] = 0.0
+        else:
+            self._queue_error[endpoint] = self.now - info.ETA
+        self._num_pending[endpoint] -= 1
+
+        self.latencies.append(self.now - info.time_requested)
+        self.last_completion = self.now
+        self._start_tasks(endpoint)
+
+    def _warm(self, endpoint):
+        self.sim[endpoint].temperature = 'WARM'
+        self._start_tasks(endpoint)
+
+    def _fail(self, endpoint):
+        sim = self.sim[endpoint]
+        sim.up = False
+        sim.failed_at = self.now
+        self._schedule(self.now + HEARTBEAT_THRESHOLD, self._check_heartbeat,
+                       endpoint, self.now)
+
+    def _check_heartbeat(self, endpoint, failed_at):
+        # The endpoint has not sent a heartbeat since it failed
+        sim = self.sim[endpoint]
+        if not sim.up and sim.failed_at == failed_at:
+            self.strategy.endpoint_changed(endpoint, 'dead')
+
+    def _recover(self, endpoint):
+        self.sim[endpoint].up = True
+        self.strategy.endpoint_changed(endpoint, 'alive')
+        self._start_tasks(endpoint)
+
+
+def load_trace(file_name, endpoints, speeds=None):
+    '''Load tasks from a JSON-lines trace. Records of the scheduler's
+    execution log are also accepted, in which case runtimes are scaled
+    back to a speed-1 endpoint using the endpoint they ran on.'''
+    speeds = speeds or {}
+    tasks = []
+    with open(file_name) as fh:
+        for line in fh:
+            record = json.loads(line)
+            if 'time' in record:
+                tasks.append(record)
+                continue
+
+            group = endpoints.get(record.get('endpoint_id'), {}).get('group')
+            tasks.append({
+                'time': record['time_requested'],
+                'function': record['function_id'],
+                'runtime': record['runtime'] * speeds.get(group, 1.0),
+                'payload_size': record.get('payload_size', 0),
+            })
+
+    tasks.sort(key=lambda x: x['time'])
+    start = tasks[0]['time'] if len(tasks) > 0 else 0.0
+    for task in tasks:
+        task['time'] -= start
+    return tasks
+
+
+def synthetic_trace(n, rate, num_functions=4, file_fraction=0.0,
+                    endpoints=None, seed=0):
+    '''Poisson arrivals of n tasks of a few functions, each with its own
+    typical runtime and payload size.'''
+    rng = random.Random(seed)
+    functions = [(f'func_{i}', rng.lognormvariate(0.0, 1.0),
+                  rng.choice([2 ** 8, 2 ** 12, 2 ** 16]))
+                 for i in range(num_functions)]
+    sources = [e for (e, x) in (endpoints or {}).items()
+               if 'transfer_group' in x]
+
+    t = 0.0
+    for _ in range(n):
+        t += rng.expovariate(rate)
+        func, runtime, payload_size = rng.choice(functions)
+        task = {
+            'time': t,
+            'function': func,
+            'runtime': runtime * rng.uniform(0.8, 1.2),
+            'payload_size': payload_size,
+        }
+        if len(sources) > 0 and rng.random() < file_fraction:
+            path = f'{func}/input_{rng.randrange(100)}.dat'
+            task['files'] = {rng.choice(sources): [(path, 2 ** 26)]}
+        yield task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoints', type=str, default='endpoints.yaml')
+    parser.add_argument('-s', '--strategy', type=str, default='round-robin')
+    parser.add_argument('-rp', '--predictor', type=str,
+                        default='rolling-average')
+    parser.add_argument('--last-n', type=int, default=3)
+    parser.add_argument('--train-every', type=int, default=1)
+    parser.add_argument('--trace', type=str, default=None)
+    parser.add_argument('--synthetic', type=int, default=1000,
+                        help='Number of tasks, if no trace is given')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='Synthetic tasks per second')
+    parser.add_argument('--functions', type=int, default=4)
+    parser.add_argument('--file-fraction', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--speed', type=str, action='append', default=[],
+                        help='group=factor')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--bandwidth', type=float, default=DEFAULT_BANDWIDTH)
+    parser.add_argument('--link-latency', type=float,
+                        default=DEFAULT_LINK_LATENCY)
+    parser.add_argument('--fail', type=str, action='append', default=[],
+                        help='endpoint_name:start:duration')
+    parser.add_argument('--json', action='store_true', default=False)
+    args = parser.parse_args()
+
+    with open(args.endpoints) as fh:
+        endpoints = yaml.safe_load(fh)
+
+    speeds = {}
+    for x in args.speed:
+        group, factor = x.split('=')
+        speeds[group] = float(factor)
+
+    names = {info['name']: e for (e, info) in endpoints.items()}
+    failures = []
+    for x in args.fail:
+        name, start, duration = x.split(':')
+        failures.append((names[name], float(start), float(duration)))
+
+    if args.trace is not None:
+        tasks = load_trace(args.trace, endpoints, speeds)
+    else:
+        tasks = synthetic_trace(args.synthetic, args.rate, args.functions,
+                                args.file_fraction, endpoints, args.seed)
+
+    simulator = Simulator(endpoints, strategy=args.strategy,
+                          runtime_predictor=args.predictor,
+                          last_n=args.last_n, train_every=args.train_every,
+                          speeds=speeds, workers=args.workers,
+                          bandwidth=args.bandwidth,
+                          link_latency=args.link_latency, failures=failures)
+    start = time.time()
+    report = simulator.run(tasks)
+    report['wall_time'] = time.time() - start
+    report['tasks_per_second'] = report['tasks'] / report['wall_time']
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Strategy {simulator.strategy}: {report['tasks']} tasks "
+              f"({report['tasks_per_second']:.0f} simulated tasks/s)")
+        print(f"Makespan: {report['makespan']:.2f}s")
+        print('Latency: ' + ', '.join(f'{k} {v:.2f}s' for (k, v)
+                                      in report['latency'].items()))
+        print('{:22} {:>8} {:>12}'.format('endpoint', 'tasks',
+                                          'utilization'))
+        for name, u in report['utilization'].items():
+            print('{:22} {:>8} {:>12.1%}'.format(
+                name, report['tasks_per_endpoint'][name], u))
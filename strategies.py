@@ -11,7 +11,7 @@ class Strategy(object):
     def __init__(self, endpoints,
                  runtime_predictor: RuntimePredictor,
                  queue_predictor, cold_start_predictor,
-                 transfer_predictor: TransferPredictor):
+                 transfer_predictor: TransferPredictor, clock=time.time):
         if len(endpoints) == 0:
             raise ValueError("List of endpoints cannot be empty")
         assert(callable(runtime_predictor))
@@ -20,15 +20,34 @@ class Strategy(object):
         assert(callable(transfer_predictor))
 
         self.endpoints = endpoints
+        self.dead_endpoints = set()
         self.runtime = runtime_predictor
         self.queue_predictor = queue_predictor
         self.cold_start_predictor = cold_start_predictor
         self.transfer_predictor = transfer_predictor
+        # Source of the current time, which simulations can replace
+        self.clock = clock
 
     def choose_endpoint(self, func, payload, files=None, exclude=None,
                         *args, **kwargs):
         raise NotImplementedError
 
+    def endpoint_changed(self, endpoint, event):
+        '''Called by the scheduler when an endpoint becomes 'dead', 'alive',
+        'cold' or 'warm'.'''
+        if event == 'dead':
+            self.dead_endpoints.add(endpoint)
+        elif event == 'alive':
+            self.dead_endpoints.discard(endpoint)
+
+    def _exclude(self, exclude):
+        '''Endpoints to exclude, including dead endpoints unless no other
+        endpoints are left.'''
+        exclude = set(exclude or ())
+        if len(exclude | self.dead_endpoints) < len(self.endpoints):
+            exclude |= self.dead_endpoints
+        return exclude
+
     def add_endpoint(self, endpoint, group):
         # TODO: explore new endpoints
         self.endpoints[endpoint] = group
@@ -42,7 +61,7 @@ class Strategy(object):
 
         t_cold = self.cold_start_predictor(endpoint, func)
         t_pending = self.queue_predictor(endpoint)
-        t_transfer = time.time()
+        t_transfer = self.clock()
         if files is not None:
             t_transfer += self.transfer_predictor(files, endpoint)
         t_run = self.runtime(func=func,
@@ -64,7 +83,7 @@ class RoundRobin(Strategy):
         self.next = 0
 
     def choose_endpoint(self, func, exclude=None, *args, **kwargs):
-        exclude = exclude or set()
+        exclude = self._exclude(exclude)
         assert(len(exclude) < len(self.endpoints))
         endpoints = list(self.endpoints.keys())
         while True:
@@ -88,7 +107,7 @@ class FastestEndpoint(Strategy):
         }
 
     def choose_endpoint(self, func, payload, exclude=None, *args, **kwargs):
-        exclude = exclude or set()
+        exclude = self._exclude(exclude)
         assert(len(exclude) < len(self.endpoints))
         excluded_groups = {g for (g, ends) in self.group_to_endpoints.items()
                            if all(e in exclude for e in ends)}
@@ -133,7 +152,7 @@ class SmallestETA(Strategy):
 
     def choose_endpoint(self, func, payload, files=None, exclude=None,
                         transfer_ETAs=None):
-        exclude = exclude or set()
+        exclude = self._exclude(exclude)
         assert(len(exclude) < len(self.endpoints))
         excluded_groups = {g for (g, ends) in self.group_to_endpoints.items()
                            if all(e in exclude for e in ends)}
@@ -0,0 +1,36 @@
+class TaskRecord(object):
+    '''Everything the scheduler knows about one copy of a task. A record is
+    kept for every pending task, so it uses slots rather than a dict.'''
+
+    __slots__ = [
+        'task_id', 'function_id', 'endpoint_id', 'payload_size', 'headers',
+        'files', 'cache_key', 'time_requested', 'transfer_num',
+        'transfer_time', 'time_sent', 'ETA', 'is_ETA_reliable', 'runtime',
+        'ATA', 'time_abandoned',
+    ]
+
+    def __init__(self, function_id, payload_size, headers, files,
+                 time_requested, cache_key=None):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+        self.function_id = function_id
+        self.payload_size = payload_size
+        self.headers = headers
+        self.files = files
+        self.time_requested = time_requested
+        self.cache_key = cache_key
+
+    def copy(self):
+        record = TaskRecord.__new__(TaskRecord)
+        for name in self.__slots__:
+            setattr(record, name, getattr(self, name))
+        return record
+
+    def to_dict(self, fields=None):
+        '''Fields (by default, all of them) which have been set.'''
+        return {name: getattr(self, name) for name in fields or self.__slots__
+                if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return 'TaskRecord({})'.format(self.to_dict())
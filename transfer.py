@@ -1,13 +1,17 @@
 import os
 import uuid
 import time
+import heapq
 import logging
-from threading import Thread
+from threading import Thread, Condition
+from collections import defaultdict
 
 import globus_sdk
 from fair_research_login import NativeClient, JSONTokenStorage
 
 from utils import colored, endpoint_name, MAX_CONCURRENT_TRANSFERS
+from retention import Retention
+from replicas import ReplicaCatalog
 
 
 logger = logging.getLogger(__name__)
@@ -19,6 +23,10 @@ logger.addHandler(ch)
 
 TOKEN_LOC = os.path.expanduser('~/.funcx/credentials/scheduler_tokens.json')
 CLIENT_ID = 'f06739da-ad7d-40bd-887f-abb1d23bbd6f'
+# Transfers are polled around when they are predicted to finish
+MIN_POLLING_INTERVAL = 0.5
+MAX_POLLING_INTERVAL = 10.0
+STATUS_BATCH_SIZE = 50  # Max transfers whose status is queried at once
 
 
 class TransferManager(object):
@@ -26,65 +34,222 @@ class TransferManager(object):
     # TODO: move TransferPredictor into this class and update prediction model
     # every time a tranfer finishes
 
-    def __init__(self, endpoints, sync_level='exists', log_level='INFO'):
+    def __init__(self, endpoints, sync_level='exists', retention_ttl=3600.0,
+                 coalesce_window=0.5, storage_quota=None,
+                 delete_evicted=False, staging_dir=None,
+                 transfer_client=None, log_level='INFO'):
 
-        transfer_scope = 'urn:globus:auth:scope:transfer.api.globus.org:all'
-        native_client = NativeClient(client_id=CLIENT_ID,
-                                     app_name="FuncX Continuum Scheduler",
-                                     token_storage=JSONTokenStorage(TOKEN_LOC))
-        native_client.login(requested_scopes=[transfer_scope], no_browser=True,
-                            no_local_server=True, refresh_tokens=True)
-        all_authorizers = native_client.get_authorizers_by_scope(
-            requested_scopes=[transfer_scope])
-        transfer_authorizer = all_authorizers[transfer_scope]
-        self.transfer_client = globus_sdk.TransferClient(transfer_authorizer)
+        if transfer_client is None:
+            transfer_client = self._login()
+        self.transfer_client = transfer_client
 
         self.endpoints = endpoints
         self.sync_level = sync_level
         logger.setLevel(log_level)
 
-        # Track pending transfers
+        # Track pending transfers. Each (numbered) transfer request maps to
+        # the keys of the Globus transfers it waits on, which may be shared
+        # with other requests for the same files.
         self._next = 0
+        self._next_key = 0
+        self.queued_transfers = {}
         self.active_transfers = {}
         self.completed_transfers = {}
         self.transfer_ids = {}
+        self._num_requests = defaultdict(int)  # key -> requests waiting on it
+        # Transfers which are no longer needed are forgotten after a while
+        self._retention = Retention(retention_ttl)
+
+        # Requests for files already being moved to the same destination
+        # wait on the existing transfer, and requests between the same
+        # endpoints within a short window are submitted together.
+        self.coalesce_window = coalesce_window
+        self._in_flight = {}  # (src, dst, path) -> key of transfer
+        self._open_batches = {}  # (src, dst) -> key of queued transfer
+
+        # At most MAX_CONCURRENT_TRANSFERS are submitted to Globus at once.
+        # Others wait in the queue, in order of priority (lowest first).
+        self._num_submitting = 0
+
+        # Files which have already been staged to each endpoint. Evicted
+        # files are only deleted from endpoints if asked to, and only if
+        # they are in the staging directory, so that users' data is safe.
+        if delete_evicted and staging_dir is None:
+            raise ValueError('Deleting evicted files requires a staging '
+                             'directory')
+        self.staging_dir = staging_dir and os.path.normpath(staging_dir)
+        self.replicas = ReplicaCatalog(
+            endpoints, default_quota=storage_quota,
+            on_evict=self._delete_files if delete_evicted else None)
+
+        # Notified when transfers are requested or completed
+        self._cv = Condition()
+        self._callbacks = []
 
         # Initialize thread to wait on transfers
-        self._polling_interval = 1
         self._tracker = Thread(target=self._track_transfers)
         self._tracker.daemon = True
         self._tracker.start()
 
-    def transfer(self, files_by_src, dst, task_id='', unique_name=False):
-        n = len(files_by_src)
-
-        empty_transfer = True
+    def _login(self):
+        transfer_scope = 'urn:globus:auth:scope:transfer.api.globus.org:all'
+        native_client = NativeClient(client_id=CLIENT_ID,
+                                     app_name="FuncX Continuum Scheduler",
+                                     token_storage=JSONTokenStorage(TOKEN_LOC))
+        native_client.login(requested_scopes=[transfer_scope], no_browser=True,
+                            no_local_server=True, refresh_tokens=True)
+        all_authorizers = native_client.get_authorizers_by_scope(
+            requested_scopes=[transfer_scope])
+        transfer_authorizer = all_authorizers[transfer_scope]
+        return globus_sdk.TransferClient(transfer_authorizer)
 
-        transfer_ids = []
-        for i, (src, pairs) in enumerate(files_by_src.items(), 1):
-            src_name = endpoint_name(src)
-            dst_name = endpoint_name(dst)
+    def add_callback(self, callback):
+        '''Call callback(key, info) whenever a transfer completes.'''
+        self._callbacks.append(callback)
 
-            if src == dst:
-                logger.debug(f'Skipped transfer from {src_name} to {dst_name}')
-                continue
-            else:
-                empty_transfer = False
+    def transfer(self, files_by_src, dst, task_id='', unique_name=False,
+                 predicted_time=None, priority=None):
+        # Files which were already staged to dst don't need to be transferred
+        if not unique_name:
+            files_by_src = self.replicas.missing(files_by_src, dst, touch=True)
+        n = len(files_by_src)
+        if priority is None:
+            priority = time.time()
 
-            files, _ = zip(*pairs)
-            logger.info(f'Transferring {src_name} to {dst_name}: {files}')
+        empty_transfer = True
 
-            src_globus = self.endpoints[src]['globus']
-            dst_globus = self.endpoints[dst]['globus']
+        keys = set()
+        with self._cv:
+            for i, (src, pairs) in enumerate(files_by_src.items(), 1):
+                src_name = endpoint_name(src)
+                dst_name = endpoint_name(dst)
 
-            tdata = globus_sdk.TransferData(self.transfer_client,
-                                            src_globus, dst_globus,
-                                            label='FuncX Transfer {} - {} of {}'
-                                            .format(self._next + 1, i, n),
-                                            sync_level=self.sync_level)
+                if src == dst:
+                    logger.debug(f'Skipped transfer from {src_name} '
+                                 f'to {dst_name}')
+                    continue
+                else:
+                    empty_transfer = False
+
+                # Wait on transfers which are already moving these files
+                new_pairs = []
+                for f, size in pairs:
+                    key = self._in_flight.get((src, dst, f))
+                    if key is not None and not unique_name:
+                        logger.debug(f'File {f} is already being '
+                                     f'transferred to {dst_name}')
+                        keys.add(key)
+                        # E.g., a task needing a file being prefetched
+                        # should not wait behind all other transfers
+                        if key in self.queued_transfers:
+                            info = self.queued_transfers[key]
+                            info['priority'] = min(info['priority'],
+                                                   priority)
+                            if predicted_time is not None:
+                                info['predicted_time'] = max(
+                                    info['predicted_time'] or 0.0,
+                                    predicted_time)
+                    else:
+                        new_pairs.append((f, size))
+
+                if len(new_pairs) > 0:
+                    files, _ = zip(*new_pairs)
+                    logger.info(f'Transferring {src_name} to {dst_name}: '
+                                f'{files}')
+                    keys.add(self._enqueue(src, dst, new_pairs,
+                                           f'{task_id} ({i}/{n})',
+                                           predicted_time, unique_name,
+                                           priority))
+
+            if empty_transfer:
+                return None
 
-            for f in files:
-                if unique_name:
+            self._next += 1
+            self.transfer_ids[self._next] = list(keys)
+            for key in keys:
+                self._num_requests[key] += 1
+
+            # Tracker may need to submit or poll sooner because of this
+            self._cv.notify_all()
+
+        if self.coalesce_window <= 0:
+            self._submit_queued()
+
+        return self._next
+
+    def _enqueue(self, src, dst, pairs, name, predicted_time, unique_name,
+                 priority):
+        '''Add files to the queued transfer between two endpoints, creating
+        it if needed, and return the transfer's key.'''
+        key = self._open_batches.get((src, dst))
+        if key is None or unique_name:
+            self._next_key += 1
+            key = str(self._next_key)
+            self.queued_transfers[key] = {
+                'src_endpoint': src,
+                'dst_endpoint': dst,
+                'src': self.endpoints[src]['globus'],
+                'dst': self.endpoints[dst]['globus'],
+                'files': [],
+                'sizes': [],
+                'name': name,
+                'unique_name': unique_name,
+                'request_time': time.time(),
+                'deadline': time.time() + self.coalesce_window,
+                'predicted_time': predicted_time,
+                'priority': priority
+            }
+            if not unique_name:
+                self._open_batches[(src, dst)] = key
+
+        info = self.queued_transfers[key]
+        for f, size in pairs:
+            info['files'].append(f)
+            info['sizes'].append(size)
+            if not unique_name:
+                self._in_flight[(src, dst, f)] = key
+        if predicted_time is not None:
+            info['predicted_time'] = max(info['predicted_time'] or 0.0,
+                                         predicted_time)
+        info['priority'] = min(info['priority'], priority)
+
+        return key
+
+    def _submit_queued(self, force=True):
+        '''Submit queued transfers to Globus, in order of priority, while
+        there are fewer than MAX_CONCURRENT_TRANSFERS. Unless forced, only
+        submit transfers whose coalescing window has passed.'''
+        with self._cv:
+            now = time.time()
+            slots = MAX_CONCURRENT_TRANSFERS - len(self.active_transfers) \
+                - self._num_submitting
+            if slots <= 0:
+                return
+
+            ready = [(k, info) for (k, info) in self.queued_transfers.items()
+                     if force or info['deadline'] <= now]
+            ready = heapq.nsmallest(slots, ready,
+                                    key=lambda x: x[1]['priority'])
+            self._num_submitting += len(ready)
+            for key, info in ready:
+                del self.queued_transfers[key]
+                batch = (info['src_endpoint'], info['dst_endpoint'])
+                if self._open_batches.get(batch) == key:
+                    del self._open_batches[batch]
+
+        for key, info in ready:
+            self._submit(key, info)
+
+    def _submit(self, key, info):
+        # Errors must not kill the tracker thread, which submits transfers
+        try:
+            tdata = globus_sdk.TransferData(
+                self.transfer_client, info['src'], info['dst'],
+                label='FuncX Transfer {}'.format(key),
+                sync_level=self.sync_level)
+
+            for f in info['files']:
+                if info['unique_name']:
                     dst_file = '~/.globus_funcx/test_{}.txt'.format(
                         str(uuid.uuid4()))
                     logger.debug('Unique destination file name: {}'
@@ -94,29 +259,61 @@ class TransferManager(object):
                     tdata.add_item(f, f)
 
             res = self.transfer_client.submit_transfer(tdata)
+        except Exception as e:
+            res = {'code': 'Failed', 'message': str(e)}
 
-            if res['code'] != 'Accepted':
-                raise ValueError('Transfer not accepted')
-
-            self.active_transfers[res['task_id']] = {
-                'src': src_globus,
-                'dst': dst_globus,
-                'files': files,
-                'name': f'{task_id} ({i}/{n})',
-                'submission_time': time.time()
-            }
-            transfer_ids.append(res['task_id'])
-
-            if len(self.active_transfers) > MAX_CONCURRENT_TRANSFERS:
-                logger.warn('More than {} concurrent transfers! Expect delays.'
-                            .format(MAX_CONCURRENT_TRANSFERS))
+        with self._cv:
+            self._num_submitting -= 1
+            info['submission_time'] = time.time()
+            info['queue_time'] = info['submission_time'] - info['deadline']
+            self.active_transfers[key] = info
 
-        if empty_transfer:
-            return None
-        else:
-            self._next += 1
-            self.transfer_ids[self._next] = transfer_ids
-            return self._next
+            if res['code'] != 'Accepted':
+                logger.error('Transfer {} not accepted: {}'
+                             .format(info['name'], res['message']))
+                self._fail(key, info)
+                return
+
+            info['globus_id'] = res['task_id']
+            # Transfers sharing the link, used to learn its capacity
+            info['link_load'] = len(self.active_on_link(info['src_endpoint'],
+                                                        info['dst_endpoint']))
+
+            self._cv.notify_all()
+
+    def link(self, src, dst):
+        return (self.endpoints[src]['transfer_group'],
+                self.endpoints[dst]['transfer_group'])
+
+    def active_on_link(self, src, dst):
+        '''Active transfers between the transfer groups of src and dst.'''
+        link = self.link(src, dst)
+        return [info for info in list(self.active_transfers.values())
+                if 'globus_id' in info
+                and self.link(info['src_endpoint'],
+                              info['dst_endpoint']) == link]
+
+    def _in_staging_dir(self, path):
+        path = os.path.normpath(path)
+        return path.startswith(self.staging_dir.rstrip('/') + '/')
+
+    def _delete_files(self, endpoint, pairs):
+        '''Delete staged files which were evicted from the replica catalog.'''
+        files = [f for (f, _) in pairs if self._in_staging_dir(f)]
+        if len(files) == 0:
+            return
+        logger.info('Deleting files evicted from {}: {}'
+                    .format(endpoint_name(endpoint), files))
+
+        ddata = globus_sdk.DeleteData(self.transfer_client,
+                                      self.endpoints[endpoint]['globus'])
+        for f in files:
+            ddata.add_item(f)
+
+        res = self.transfer_client.submit_delete(ddata)
+        if res['code'] != 'Accepted':
+            logger.error('Could not delete files from {}: {}'
+                         .format(endpoint_name(endpoint), res['message']))
 
     def is_complete(self, num):
         assert(num <= self._next)
@@ -124,6 +321,11 @@ class TransferManager(object):
         return all(t in self.completed_transfers
                    for t in self.transfer_ids[num])
 
+    def has_failed(self, num):
+        '''Whether a complete transfer failed to move some of its files.'''
+        return any(self.completed_transfers[t].get('status') == 'FAILED'
+                   for t in self.transfer_ids[num])
+
     def get_transfer_time(self, num):
         if not self.is_complete(num):
             raise ValueError('Cannot get transfer time of incomplete transfer')
@@ -131,35 +333,183 @@ class TransferManager(object):
         return max(self.completed_transfers[t]['time_taken']
                    for t in self.transfer_ids[num])
 
-    def wait(self, num):
-        while not self.is_complete(num):
-            pass
+    def release(self, num):
+        '''Mark a transfer as no longer needed, so that it can eventually
+        be forgotten.'''
+        self._retention.add(num)
+
+    def collect_garbage(self, now=None):
+        with self._cv:
+            for num in self._retention.expired(now):
+                for key in self.transfer_ids.pop(num, []):
+                    # Transfers may be shared with other requests
+                    self._num_requests[key] -= 1
+                    if self._num_requests[key] == 0:
+                        del self._num_requests[key]
+                        self.completed_transfers.pop(key, None)
+
+    def memory_footprint(self):
+        return {
+            'queued_transfers': len(self.queued_transfers),
+            'active_transfers': len(self.active_transfers),
+            'completed_transfers': len(self.completed_transfers),
+            'transfer_ids': len(self.transfer_ids),
+            'replicas': len(self.replicas),
+        }
+
+    def wait(self, num, timeout=None):
+        '''Block until transfer num completes, and return whether it did.'''
+        with self._cv:
+            return self._cv.wait_for(lambda: self.is_complete(num), timeout)
+
+    def expected_wait(self, priority=None):
+        '''Predicted time until a new transfer with the given priority (by
+        default, the lowest) would be submitted to Globus.'''
+        now = time.time()
+        with self._cv:
+            # Times at which the active transfers will free up their slots
+            slots = [max(info['submission_time']
+                         + (info['predicted_time'] or 0.0), now)
+                     for info in self.active_transfers.values()]
+            slots += [now] * self._num_submitting
+            ahead = [info['predicted_time'] or 0.0
+                     for info in self.queued_transfers.values()
+                     if priority is None or info['priority'] <= priority]
+
+        slots += [now] * max(MAX_CONCURRENT_TRANSFERS - len(slots), 0)
+        heapq.heapify(slots)
+        while len(slots) > MAX_CONCURRENT_TRANSFERS:
+            heapq.heappop(slots)
+
+        # Transfers queued ahead take the first slots to free up
+        for predicted_time in ahead:
+            heapq.heappush(slots, heapq.heappop(slots) + predicted_time)
+
+        return self.coalesce_window + slots[0] - now
+
+    def _polling_delay(self):
+        now = time.time()
+        delays = [info['deadline'] - now
+                  for info in list(self.queued_transfers.values())
+                  if info['deadline'] > now]
+        for info in list(self.active_transfers.values()):
+            elapsed = now - info['submission_time']
+            remaining = (info['predicted_time'] or 0.0) - elapsed
+            if remaining > 0:
+                delays.append(remaining)
+            else:  # Back off on transfers taking longer than predicted
+                delays.append(0.25 * elapsed)
+
+        if len(delays) == 0:
+            return None  # Nothing to do until a transfer is requested
+        return min(max(min(delays), MIN_POLLING_INTERVAL),
+                   MAX_POLLING_INTERVAL)
+
+    def _get_tasks(self, transfer_ids):
+        '''Query the Globus tasks of many transfers with few requests.'''
+        tasks = {}
+        for i in range(0, len(transfer_ids), STATUS_BATCH_SIZE):
+            batch = transfer_ids[i:i + STATUS_BATCH_SIZE]
+            for task in self.transfer_client.task_list(
+                    num_results=len(batch),
+                    filter='task_id:' + ','.join(batch)):
+                tasks[task['task_id']] = task
+        return tasks
+
+    def _copied_files(self, info, task):
+        '''(path, size) of the files a successful transfer copied. Files
+        skipped because of sync_level were already at the destination, so
+        they are not the scheduler's to track (or to delete).'''
+        pairs = list(zip(info['files'], info['sizes']))
+        if task.get('files_skipped', 0) == 0:
+            return pairs
+
+        try:
+            copied = {x['destination_path'] for x in
+                      self.transfer_client.task_successful_transfers(
+                          info['globus_id'])}
+        except Exception as e:
+            logger.error('Could not get files copied by transfer {}: {}'
+                         .format(info['name'], e))
+            return []
+        return [(f, size) for (f, size) in pairs if f in copied]
+
+    def _fail(self, key, info):
+        '''Complete a transfer which failed, so that requests waiting on it
+        see the failure (see has_failed) instead of waiting forever.'''
+        info['status'] = 'FAILED'
+        info['time_taken'] = time.time() - info['submission_time']
+        self.completed_transfers[key] = info
+        self._finish(key, info)
+        self._cv.notify_all()
+
+    def _finish(self, key, info):
+        '''Stop tracking a transfer which is no longer active.'''
+        del self.active_transfers[key]
+        for f in info['files']:
+            file_key = (info['src_endpoint'], info['dst_endpoint'], f)
+            if self._in_flight.get(file_key) == key:
+                del self._in_flight[file_key]
 
     def _track_transfers(self):
         logger.info('Started transfer tracking thread')
 
         while True:
-            time.sleep(self._polling_interval)
+            with self._cv:
+                self._cv.wait(self._polling_delay())
+
+            self._submit_queued(force=False)
+
+            if len(self.active_transfers) == 0:
+                continue
 
-            for transfer_id, info in list(self.active_transfers.items()):
+            keys = {info['globus_id']: key
+                    for (key, info) in list(self.active_transfers.items())}
+            try:
+                tasks = self._get_tasks(list(keys))
+            except Exception as e:
+                logger.error('Could not get status of transfers: {}'
+                             .format(e))
+                continue
+
+            for transfer_id, task in tasks.items():
+                status = task['status']
+                key = keys[transfer_id]
+                info = self.active_transfers[key]
                 name = info['name']
-                status = self.transfer_client.get_task(transfer_id)
 
-                if status['status'] == 'FAILED':
+                if status == 'FAILED':
                     logger.error('Task {} failed. Canceling task!'
                                  .format(transfer_id))
-                    res = self.transfer_client.cancel_task(transfer_id)
+                    try:
+                        res = self.transfer_client.cancel_task(transfer_id)
+                    except Exception as e:
+                        res = {'code': 'Failed', 'message': str(e)}
                     if res['code'] != 'Canceled':
                         logger.error('Could not cancel task {}. Reason: {}'
                                      .format(transfer_id, res['message']))
-                    del self.active_transfers[transfer_id]
+                    with self._cv:
+                        self._fail(key, info)
 
-                elif status['status'] == 'ACTIVE':
+                elif status == 'ACTIVE':
                     continue
 
-                elif status['status'] == 'SUCCEEDED':
+                elif status == 'SUCCEEDED':
                     info['time_taken'] = time.time() - info['submission_time']
                     logger.info('Globus transfer {} finished in time {}'
                                 .format(name, info['time_taken']))
-                    self.completed_transfers[transfer_id] = info
-                    del self.active_transfers[transfer_id]
+                    with self._cv:
+                        info['status'] = 'SUCCEEDED'
+                        self.completed_transfers[key] = info
+                        self._finish(key, info)
+                        self._cv.notify_all()
+
+                    if not info['unique_name']:
+                        self.replicas.add(info['dst_endpoint'],
+                                          self._copied_files(info, task))
+
+                    for callback in self._callbacks:
+                        callback(key, info)
+
+            # Finished transfers free up slots for queued ones
+            self._submit_queued(force=False)
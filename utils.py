@@ -1,5 +1,8 @@
+import os
+import json
 import yaml
 import time
+import tempfile
 from datetime import datetime
 from queue import Queue
 
@@ -22,6 +25,20 @@ def avg(x):
     return sum(x) / len(x)
 
 
+def write_json(file_name, data):
+    '''Write data to a JSON file atomically, so that a crash never leaves
+    a truncated file behind.'''
+    directory = os.path.dirname(os.path.abspath(file_name))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp',
+                                     delete=False) as fh:
+        json.dump(data, fh)
+    try:
+        os.replace(fh.name, file_name)
+    except OSError:
+        os.remove(fh.name)
+        raise
+
+
 def fmt_time(t=None, fmt='%H:%M:%S'):
     return datetime.fromtimestamp(t or time.time()).strftime(fmt)
 